@@ -10,7 +10,7 @@ import time
 import pandas as pd
 from mlxtend.preprocessing import TransactionEncoder
 from mlxtend.frequent_patterns import apriori, fpgrowth
-from src.fpgrowth import fpgrowth_mp
+from src.fpgrowth import fpgrowth_mp, fpgrowth_sweep
 
 
 def run_benchmark(func: Callable) -> float:
@@ -37,6 +37,11 @@ def run_fpgrowth_mp(name: str, data: any, min_support: float, out: list[any]):
     (name, min_support, 'fpgrowth_sp', run_benchmark(lambda : fpgrowth_mp(min_support, data, max_workers=0)) ),
   ]  
 
+def run_fpgrowth_sweep(name: str, data: any, min_supports: Sequence[float], out: list[any]):
+  out+=[
+    (name, min(min_supports), 'fpgrowth_sweep', run_benchmark(lambda : fpgrowth_sweep(data, min_supports)) ),
+  ]
+
 BENCHMARK_DATASETS = [ 
   ('T10I4D100K', datasets.load_T10I4D100K,np.logspace(-3,-1, base=10, num=7)),
   #('T40I10D100K', datasets.load_T40I10D100K, np.logspace(-2,-1, base=10, num=7)),
@@ -52,6 +57,7 @@ results = []
 for (name, loadfn, test_supports) in BENCHMARK_DATASETS:
   try:
     dataset = loadfn()
+    run_fpgrowth_sweep(name, dataset, test_supports, results)
     for min_support in test_supports:
       run_fpgrowth_mp(name, dataset, min_support, results)
       run_mlxtend_algorithms(name, dataset, min_support, results)
@@ -16,6 +16,17 @@ def __load_lines(file: TextIOWrapper, split_by: str ):
             pass    
     return result
 
+# converts the text file to the binary format next to it on first use,
+# then memory maps it: returns (indptr, items, dictionary)
+def __load_binary(file_name: str, split_by: str):
+    # imported here: the scripts also import this module as plain `datasets`
+    from src.transactions import convert_to_binary, load_binary
+    file = DATASETS_PATH + file_name
+    binary = path.splitext(file)[0] + ".trx"
+    if not path.exists(binary) or path.getmtime(binary) < path.getmtime(file):
+        convert_to_binary(file, binary, split_by)
+    return load_binary(binary)
+
 def load_T10I4D100K():
     file = DATASETS_PATH + "transactional_T10I4D100K.csv"
     transactions = []
@@ -86,4 +97,19 @@ def load_pippo():
 def load_kosarak():
     path = DATASETS_PATH + "pumsb.dat"
     with open(path, 'r') as file:
-        return __load_lines(file, ' ')
\ No newline at end of file
+        return __load_lines(file, ' ')
+
+def load_T10I4D100K_binary():
+    return __load_binary("transactional_T10I4D100K.csv", ',')
+
+def load_retail_binary():
+    return __load_binary("retail.dat", ' ')
+
+def load_T40I10D100K_binary():
+    return __load_binary("T40I10D100K.dat", ' ')
+
+def load_chess_binary():
+    return __load_binary("chess.dat", ' ')
+
+def load_pumsb_binary():
+    return __load_binary("pumsb.dat", ' ')
@@ -0,0 +1,58 @@
+from collections import deque
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from .FlatFPTree import FlatFPTree
+from .FrequentItemPreprocessor import FrequentItemPreprocessor, Transaction, to_csr, unique_codes
+from .fpgrowth import fpgrowth_tree
+
+
+# frequent itemsets over the last `panes` batches of transactions. A single tree holds
+# the whole window: a new batch is added to it and the batch falling out of the window
+# is subtracted from the node supports, so a slide only touches the paths of two batches
+class FPTreeWindow:
+    panes: int
+    max_drift: float
+    tree: FlatFPTree
+    window: deque[tuple[np.ndarray, np.ndarray]]
+
+    def __init__(self, panes: int, max_drift: float = 0.1):
+        if panes < 1:
+            raise ValueError("a window needs at least one pane")
+        self.panes = panes
+        self.max_drift = max_drift
+        # every item gets a label, an item rare in the window can be frequent in the next one
+        fip = FrequentItemPreprocessor(0)
+        fip.set_frequent_items([], [], 0)
+        self.tree = FlatFPTree(fip)
+        self.window = deque()
+
+    def push(self, transactions: list[Transaction]):
+        self.push_csr(*to_csr(transactions))
+
+    # slides the window by one batch, stored as CSR arrays (see to_csr)
+    def push_csr(self, indptr: np.ndarray, items: np.ndarray):
+        self.tree.add_items(unique_codes(items)[0].tolist())
+        self.tree.append_csr(indptr, items, max_drift=self.max_drift)
+        self.window.append((indptr, items))
+        if len(self.window) > self.panes:
+            self.tree.remove_csr(*self.window.popleft())
+            # nodes of expired paths keep no support, the tree is compacted once they are the most.
+            # compacting also drops the labels of items that left the window
+            if 2 * np.count_nonzero(self.tree.node_supports[:self.tree.node_next]) < self.tree.node_next:
+                self.tree.reorder()
+
+    @property
+    def transactions_count(self) -> int:
+        return self.tree.fip.transactions_count
+
+    def iter_itemsets(self, min_support: float, max_workers = 0) -> Iterator[tuple[float, frozenset]]:
+        return fpgrowth_tree(min_support, self.tree, max_workers)
+
+    def itemsets(self, min_support: float, max_workers = 0) -> pd.DataFrame:
+        return pd.DataFrame(
+            data=list(self.iter_itemsets(min_support, max_workers)),
+            columns=('support', 'itemsets')
+        )
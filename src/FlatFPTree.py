@@ -1,13 +1,21 @@
+import copy
+import functools
 import os
 import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import json
+import multiprocessing.shared_memory
+import sys
 from dataclasses import dataclass
-from enum import Enum
+from enum import IntEnum
 
-from typing import Optional, Self
+from typing import Hashable, Iterable, Iterator, Optional, Self
 
 import numpy as np
 import pandas as pd
-from .FrequentItemPreprocessor import FittedTransaction, FrequentItemPreprocessor, Transaction
+from .FrequentItemPreprocessor import FittedTransaction, FrequentItemPreprocessor, Transaction, item_array, to_csr
 
 
 @dataclass 
@@ -21,70 +29,144 @@ class FrozenTree:
     fip: FrequentItemPreprocessor
     headers: list[list[FrozenNode]]
 
-class FlatTreeNodeTy(Enum):
+# a tree published in shared memory (see FlatFPTree.share), small enough to go with every
+# batch of work: the label supports are in the segment, workers label items by themselves
+@dataclass
+class SharedFlatFPTree:
+    name: str
+    node_count: int
+    header_count: int
+    label_count: int
+    min_support: int
+    transactions_count: int
+
+class FlatTreeNodeTy(IntEnum):
     Left = 0
     Right = 1
 
+ITEMSET_MODES = ('all', 'closed', 'maximal')
+EXECUTORS = ('thread', 'process', 'serial')
+
+# a conditional pattern base as CSR arrays: indptr, labels, count of each path
+type ConditionalBase = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# fewest labels of fitted transactions for which workers build the tree, below that starting
+# them and merging their trees costs more than building the tree alone
+PARALLEL_BUILD_MIN_LABELS = 500_000
+
+# largest paths x labels matrix the pair supports of a conditional tree are computed from,
+# and largest labels x labels matrix of pair supports kept by the tree while it is mined
+PAIR_SUPPORTS_MAX_CELLS = 1 << 22
+
+NODE_FIELDS = ('types', 'labels', 'supports', 'parents', 'lefts', 'rights')
+
 class FlatFPTree:
     fip: FrequentItemPreprocessor
     labels: list[list[int]]
     node_next: int
-    node_types: list[int]
-    node_labels: list[int]
-    node_supports: list[int]
-    node_parents: list[int]
-    node_lefts: list[int]
-    node_rights: list[int]
-
-    def __init__(self, fip: FrequentItemPreprocessor):
+    node_capacity: int
+    node_types: np.ndarray
+    node_labels: np.ndarray
+    node_supports: np.ndarray
+    node_parents: np.ndarray
+    node_lefts: np.ndarray
+    node_rights: np.ndarray
+    # support of every pair of labels, row label with any lower column label, when known
+    pair_supports: Optional[np.ndarray]
+
+    def __init__(self, fip: FrequentItemPreprocessor, capacity: int = 1024):
         self.fip = fip
+        self.pair_supports = None
         self.labels = []
         self.node_next: int = 0
-        self.node_types = []
-        self.node_labels = []
-        self.node_supports = []
-        self.node_parents = []
-        self.node_lefts = []
-        self.node_rights = []
+        self.node_capacity = 0
+        self.node_types = np.empty(0, dtype=np.int32)
+        self.node_labels = np.empty(0, dtype=np.int32)
+        self.node_supports = np.empty(0, dtype=np.int32)
+        self.node_parents = np.empty(0, dtype=np.int32)
+        self.node_lefts = np.empty(0, dtype=np.int32)
+        self.node_rights = np.empty(0, dtype=np.int32)
+        self.reserve(max(capacity, fip.number_of_frequent_one_items))
         for label in range(fip.number_of_frequent_one_items):
             self.labels.append([])
             self.create_left(label, parent = -1)
-        
+
+    # make room for at least `capacity` nodes, buffers only grow
+    def reserve(self, capacity: int) -> None:
+        if capacity <= self.node_capacity:
+            return
+        used = self.node_next
+        def grow(buffer: np.ndarray, fill: int) -> np.ndarray:
+            grown = np.full(capacity, fill, dtype=np.int32)
+            grown[:used] = buffer[:used]
+            return grown
+        self.node_types = grow(self.node_types, 0)
+        self.node_labels = grow(self.node_labels, -1)
+        self.node_supports = grow(self.node_supports, 0)
+        self.node_parents = grow(self.node_parents, -1)
+        self.node_lefts = grow(self.node_lefts, -1)
+        self.node_rights = grow(self.node_rights, -1)
+        self.node_capacity = capacity
+        self.__bind_views()
+
+    # scalar access goes through memoryviews, indexing them yields plain ints
+    # which is several times cheaper than boxing numpy scalars
+    def __bind_views(self) -> None:
+        self.__node_types = memoryview(self.node_types)
+        self.__node_labels = memoryview(self.node_labels)
+        self.__node_supports = memoryview(self.node_supports)
+        self.__node_parents = memoryview(self.node_parents)
+        self.__node_lefts = memoryview(self.node_lefts)
+        self.__node_rights = memoryview(self.node_rights)
+
+    # only the used part of the buffers is shipped to other processes
+    def __getstate__(self):
+        state = {
+            key: value for key, value in self.__dict__.items()
+                if not isinstance(value, memoryview)
+        }
+        for key, value in state.items():
+            if key.startswith('node_') and isinstance(value, np.ndarray):
+                state[key] = value[:self.node_next]
+        state['node_capacity'] = self.node_next
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__bind_views()
+
     def create_node(self, ty: FlatTreeNodeTy,*, label: Optional[int] = None, parent: int = -1):
         i = self.node_next
-        self.node_types.append(ty)
-        self.node_supports.append(0)
-        self.node_parents.append(parent)
-        self.node_lefts.append(-1)
-        self.node_rights.append(-1)
+        if i == self.node_capacity:
+            self.reserve(max(2 * self.node_capacity, 1))
+        self.__node_types[i] = ty
+        self.__node_parents[i] = parent
         self.node_next = i + 1
         if label is not None:
-            self.node_labels.append(label)
+            self.__node_labels[i] = label
             self.labels[label].append(i)
-        else:
-            self.node_labels.append(-1)
         return i
     def support(self, node: int) -> int:
-        return self.node_supports[node]
+        return self.__node_supports[node]
     def right(self, node: int) -> int:
-        return self.node_rights[node]
+        return self.__node_rights[node]
     def left(self, node: int) -> int:
-        return self.node_lefts[node]
+        return self.__node_lefts[node]
     def parent(self, node: int) -> int:
-        return self.node_parents[node]
+        return self.__node_parents[node]
     def label(self, node: int) -> int:
-        return self.node_labels[node]
+        return self.__node_labels[node]
     
     def set_right(self, node: int, right: int) -> None:
-        self.node_rights[node] = right
+        self.__node_rights[node] = right
     def set_left(self, node: int, left: int) -> None:
-        self.node_lefts[node] = left
+        self.__node_lefts[node] = left
     def set_parent(self, node: int, parent: int) -> None:
-        self.node_parents[node] = parent
+        self.__node_parents[node] = parent
     def set_label(self, node: int, label: int) -> None:
-        self.node_labels[node] = label
+        self.__node_labels[node] = label
     def use(self, node: int, uses: int = 1) -> None:
-        self.node_supports[node] += uses
+        self.__node_supports[node] += uses
     
     def create_left(self, label: int, parent: int):
         return self.create_node(FlatTreeNodeTy.Left, label = label, parent = parent )
@@ -145,6 +227,285 @@ class FlatFPTree:
         #print("Adding transaction", (self.fip.to_items(trx), count))
         self.__add_fitted_transaction(trx, count=count)
      
+    # used part of the node buffers, by field name
+    def node_arrays(self) -> dict[str, np.ndarray]:
+        return { name: getattr(self, 'node_' + name)[:self.node_next] for name in NODE_FIELDS }
+
+    @classmethod
+    def from_fitted(cls, fip: FrequentItemPreprocessor, csr: tuple[np.ndarray, np.ndarray], counts: Optional[np.ndarray] = None, max_workers: int = 0, pool: Optional[concurrent.futures.Executor] = None) -> Self:
+        if max_workers > 1 and csr[0][-1] - csr[0][0] >= PARALLEL_BUILD_MIN_LABELS:
+            return cls.__from_fitted_mp(fip, csr, counts, max_workers, pool)
+        tree = cls(fip)
+        tree.add_fitted_transactions(*csr, counts)
+        return tree
+
+    # rows are split in shards with about the same number of labels, every worker builds the
+    # tree of a shard and the partial trees are merged (see from_parts), so skewed first
+    # labels do not leave one worker with most of the tree.
+    # shards are built by the workers of pool when given, by a new process pool otherwise
+    @classmethod
+    def __from_fitted_mp(cls, fip: FrequentItemPreprocessor, csr: tuple[np.ndarray, np.ndarray], counts: Optional[np.ndarray], max_workers: int, pool: Optional[concurrent.futures.Executor] = None) -> Self:
+        indptr, labels = np.asarray(csr[0]), np.asarray(csr[1])
+        counts = np.ones(len(indptr) - 1, dtype=np.int64) if counts is None else np.asarray(counts)
+        bounds = np.searchsorted(indptr, np.linspace(indptr[0], indptr[-1], max_workers + 1)[1:-1])
+        edges = np.unique(np.r_[0, bounds, len(indptr) - 1])
+
+        with contextlib.nullcontext(pool) if pool is not None else concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(mp_build, fip, indptr[start:end + 1] - indptr[start], labels[indptr[start]:indptr[end]], counts[start:end])
+                for start, end in zip(edges[:-1].tolist(), edges[1:].tolist())
+            ]
+            parts = [ fut.result() for fut in futures ]
+        return cls.from_parts(fip, parts)
+
+    # merges partial trees built from different rows with the same preprocessor: the nodes
+    # ending the same path in any of them become one node, with the sum of their supports.
+    # every part also holds the depth of its nodes (see node_depths). Paths are merged one
+    # depth at a time, then the children of every node are laid out as traverse does: the
+    # child labelled one past the node is its left node, every other child is the left node
+    # of a right node labelled one before it, and those right nodes are chained by label
+    @classmethod
+    def from_parts(cls, fip: FrequentItemPreprocessor, parts: list[dict[str, np.ndarray]]) -> Self:
+        roots = fip.number_of_frequent_one_items
+        root_supports = np.zeros(roots, dtype=np.int64)
+        offsets = np.cumsum([0] + [ len(part['labels']) for part in parts ])
+        nodes, node_labels, node_supports, node_depths, node_parents = [], [], [], [], []
+        for offset, part in zip(offsets.tolist(), parts):
+            root_supports += part['supports'][:roots]
+            kept = np.flatnonzero(part['types'] == FlatTreeNodeTy.Left)
+            kept = kept[kept >= roots]
+            nodes.append(kept + offset)
+            node_labels.append(part['labels'][kept])
+            node_supports.append(part['supports'][kept])
+            node_depths.append(part['depths'][kept])
+            parents = part['parents'][kept].astype(np.int64)
+            # root nodes are the same in every part
+            node_parents.append(np.where(parents >= roots, parents + offset, parents))
+        nodes = np.concatenate(nodes) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+        node_labels = np.concatenate(node_labels) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+        node_supports = np.concatenate(node_supports) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+        node_depths = np.concatenate(node_depths) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+        node_parents = np.concatenate(node_parents) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+
+        # merged node of every node of the parts, root nodes are merged already
+        merged = np.arange(offsets[-1], dtype=np.int64)
+        merged_parents, merged_labels, merged_supports = [], [], []
+        merged_count = roots
+        by_depth = np.argsort(node_depths, kind='stable')
+        depth_bounds = np.searchsorted(node_depths[by_depth], np.arange(1, int(node_depths.max(initial=0)) + 2))
+        for begin, end in zip(depth_bounds[:-1].tolist(), depth_bounds[1:].tolist()):
+            level = by_depth[begin:end]
+            keys, inverse = np.unique(merged[node_parents[level]] * max(roots, 1) + node_labels[level], return_inverse=True)
+            merged[nodes[level]] = merged_count + inverse.reshape(-1)
+            merged_parents.append(keys // max(roots, 1))
+            merged_labels.append(keys % max(roots, 1))
+            merged_supports.append(np.bincount(inverse.reshape(-1), weights=node_supports[level], minlength=len(keys)))
+            merged_count += len(keys)
+        parents = np.concatenate(merged_parents) if len(merged_parents) > 0 else np.zeros(0, dtype=np.int64)
+        labels = np.concatenate(merged_labels) if len(merged_labels) > 0 else np.zeros(0, dtype=np.int64)
+        supports = np.concatenate(merged_supports) if len(merged_supports) > 0 else np.zeros(0)
+        children = np.arange(roots, merged_count)
+
+        all_labels = np.r_[np.arange(roots), labels]
+        next_child = labels == all_labels[parents] + 1
+        # right nodes of the other children, in order of parent then label
+        others = np.flatnonzero(~next_child)
+        others = others[np.lexsort((labels[others], parents[others]))]
+        rights = np.arange(merged_count, merged_count + len(others))
+
+        tree = cls(fip, capacity=merged_count + len(others))
+        tree.node_next = merged_count + len(others)
+        tree.node_supports[:roots] = root_supports
+        tree.node_types[children] = FlatTreeNodeTy.Left
+        tree.node_labels[children] = labels
+        tree.node_supports[children] = np.rint(supports).astype(np.int32)
+        tree.node_parents[children] = parents
+        tree.node_lefts[parents[next_child]] = children[next_child]
+
+        tree.node_types[rights] = FlatTreeNodeTy.Right
+        tree.node_labels[rights] = labels[others] - 1
+        tree.node_parents[rights] = parents[others]
+        tree.node_lefts[rights] = children[others]
+        chained = np.r_[parents[others][1:] == parents[others][:-1], False] if len(others) > 0 else np.zeros(0, dtype=bool)
+        tree.node_rights[rights[chained]] = rights[1:][chained[:-1]]
+        heads = np.r_[True, ~chained[:-1]] if len(others) > 0 else np.zeros(0, dtype=bool)
+        tree.node_rights[parents[others][heads]] = rights[heads]
+
+        # header lists: the root node first, then the other left nodes with that label
+        lefts = children[np.argsort(labels, kind='stable')]
+        bounds = np.searchsorted(tree.node_labels[lefts], np.arange(1, roots))
+        tree.labels = [
+            [label] + nodes.tolist() for label, nodes in enumerate(np.split(lefts, bounds))
+        ] if roots > 0 else []
+        return tree
+
+    # inserts every row of a CSR matrix produced by FrequentItemPreprocessor.transform_batch.
+    # rows are sorted lexicographically and duplicates merged into weighted rows, then
+    # each row only walks the suffix it does not share with the previous one
+    def add_fitted_transactions(self, indptr: np.ndarray, labels: np.ndarray, counts: Optional[np.ndarray] = None):
+        indptr = np.asarray(indptr)
+        lengths = np.diff(indptr)
+        counts = np.ones(len(lengths), dtype=np.int64) if counts is None else np.asarray(counts)
+        rows = np.flatnonzero(lengths > 0)
+        if len(rows) == 0:
+            return
+        lengths = lengths[rows]
+        counts = counts[rows]
+
+        labels = np.asarray(labels)
+        begins = indptr[:-1][rows]
+        order, starts, shared = FlatFPTree.__sort_rows(labels, begins, lengths)
+
+        # merge duplicates
+        lengths = lengths[order][starts]
+        counts = np.add.reduceat(counts[order], starts)
+        begins = begins[order[starts]]
+
+        path: list[int] = []
+        visited: list[int] = []
+        # last right node of the children chain of a node, rows come in increasing
+        # order so a new child almost always goes past it and the chain is not walked
+        tails: dict[int, int] = dict()
+        # only the labels a distinct row does not share with the previous one are walked
+        suffixes = lengths - shared
+        suffix_begins = np.cumsum(suffixes) - suffixes
+        flat = labels[np.repeat(begins + shared - suffix_begins, suffixes) + np.arange(suffixes.sum())].tolist()
+        for begin, length, prefix in zip(suffix_begins.tolist(), suffixes.tolist(), shared.tolist()):
+            del path[prefix:]
+            suffix = flat[begin:begin + length]
+            if prefix == 0:
+                path.append(self.labels[suffix[0]][0])
+                suffix = suffix[1:]
+            node = path[-1]
+            for label in suffix:
+                tail = tails.get(node, node)
+                while self.right(tail) >= 0:
+                    tail = self.right(tail)
+                if tail != node and self.label(tail) < label:
+                    child = self.traverse(tail, self.label(tail), label, parent = node)
+                else:
+                    child = self.traverse(node, self.label(node), label, parent = node)
+                if self.right(node) >= 0:
+                    tails[node] = tail
+                node = child
+                path.append(node)
+            visited.extend(path)
+
+        # every node gets the counts of the rows walking through it
+        supports = np.bincount(visited, weights=np.repeat(counts, lengths), minlength=self.node_next)
+        self.node_supports[:self.node_next] += np.rint(supports).astype(np.int32)
+
+    # rows given by their begins in labels and their lengths, in lexicographic order (a prefix
+    # sorts before its extensions); the first of every run of equal rows in that order, and
+    # the length of the prefix each of them shares with the previous one
+    @staticmethod
+    def __sort_rows(labels: np.ndarray, begins: np.ndarray, lengths: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # padding to the longest row is fastest, unless a few long rows make it far larger than the rows
+        if len(lengths) * int(lengths.max()) <= 4 * int(lengths.sum()):
+            padded = np.full((len(lengths), lengths.max()), -1, dtype=np.int32)
+            columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            padded[np.repeat(np.arange(len(lengths)), lengths), columns] = labels[np.repeat(begins, lengths) + columns]
+            order = np.lexsort(padded.T[::-1])
+            padded = padded[order]
+            starts = np.flatnonzero(np.r_[True, (padded[1:] != padded[:-1]).any(axis=1)])
+            padded = padded[starts]
+            shared = np.zeros(len(starts), dtype=np.int64)
+            shared[1:] = np.argmin(padded[1:] == padded[:-1], axis=1)
+            return order, starts, shared
+
+        # otherwise rows are sorted one position at a time, each only among the rows sharing its
+        # prefix so far: a row is left out once no other row shares its prefix or once it ends,
+        # so the work is bounded by the number of labels
+        order = np.arange(len(lengths))
+        group_starts = np.zeros(len(lengths), dtype=bool)
+        group_starts[0] = True
+        shared = np.zeros(len(lengths), dtype=np.int64)
+        # positions in order still sharing their prefix with another row, and the first position of their group
+        unsettled = np.arange(len(lengths))
+        groups = np.zeros(len(lengths), dtype=np.int64)
+        position = 0
+        while len(unsettled) > 0:
+            members = order[unsettled]
+            keys = np.full(len(members), -1, dtype=np.int64)
+            going_on = lengths[members] > position
+            keys[going_on] = labels[begins[members[going_on]] + position]
+            # groups are contiguous and in order already, rows only move within their group
+            moved = np.lexsort((keys, groups))
+            keys = keys[moved]
+            order[unsettled] = members[moved]
+
+            first = np.r_[True, (keys[1:] != keys[:-1]) | (groups[1:] != groups[:-1])]
+            split = first & np.r_[False, groups[1:] == groups[:-1]]
+            group_starts[unsettled[split]] = True
+            shared[unsettled[split]] = position
+            ids = np.cumsum(first) - 1
+            left = (keys >= 0) & (np.bincount(ids)[ids] > 1)
+            groups = unsettled[np.flatnonzero(first)][ids][left]
+            unsettled = unsettled[left]
+            position += 1
+        starts = np.flatnonzero(group_starts)
+        return order, starts, shared[starts]
+
+    # adds new transactions to a built tree, the supports of labelled items grow with them.
+    # labels keep their order until more than max_drift of consecutive labels fall out of it
+    def append_csr(self, indptr: np.ndarray, items: np.ndarray, max_drift: float = 0.1):
+        self.fip.update_csr(indptr, items)
+        self.add_fitted_transactions(*self.fip.transform_batch(indptr, items))
+        if self.fip.order_drift() > max_drift:
+            self.reorder()
+
+    def append_transactions(self, transactions: list[Transaction], max_drift: float = 0.1):
+        self.append_csr(*to_csr(transactions), max_drift=max_drift)
+
+    # takes back transactions added before, nodes left without support stay in the tree
+    # until it is rebuilt by reorder
+    def remove_csr(self, indptr: np.ndarray, items: np.ndarray):
+        self.fip.update_csr(indptr, items, count=-1)
+        self.add_fitted_transactions(*self.fip.transform_batch(indptr, items), np.full(len(indptr) - 1, -1, dtype=np.int64))
+
+    # labels new items after the current ones, each with a root node of its own
+    def add_items(self, items: Iterable[Hashable]):
+        self.fip.add_items(items)
+        for label in range(len(self.labels), self.fip.number_of_frequent_one_items):
+            self.labels.append([])
+            self.create_left(label, parent = -1)
+
+    # weighted transactions held by the tree as a CSR matrix of labels, with their counts:
+    # a node ends as many transactions as its support exceeds the supports of its children
+    def paths(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        parents = self.node_parents[:self.node_next]
+        supports = self.node_supports[:self.node_next].astype(np.int64)
+        lefts = self.node_types[:self.node_next] == FlatTreeNodeTy.Left
+        children = lefts & (parents >= 0)
+        ending = supports - np.rint(np.bincount(parents[children], weights=supports[children], minlength=self.node_next)).astype(np.int64)
+        ends = np.flatnonzero(lefts & (ending > 0))
+
+        indptr = np.zeros(len(ends) + 1, dtype=np.int64)
+        np.cumsum(self.node_depths()[ends] + 1, out=indptr[1:])
+        labels = np.zeros(indptr[-1], dtype=np.int32)
+        # every path is written from its end up to its root
+        nodes = ends.copy()
+        positions = indptr[1:] - 1
+        alive = nodes >= 0
+        while alive.any():
+            labels[positions[alive]] = self.node_labels[nodes[alive]]
+            nodes[alive] = parents[nodes[alive]]
+            positions -= 1
+            alive &= nodes >= 0
+        return indptr, labels, ending[ends]
+
+    # relabels items by their current supports and rebuilds the tree from its own paths,
+    # the transactions it was built from are not needed again. Items left without support
+    # are dropped with their root nodes (see FrequentItemPreprocessor.reordered)
+    def reorder(self) -> None:
+        fip, relabel = self.fip.reordered()
+        indptr, labels, counts = self.paths()
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        labels = relabel[labels]
+        labels = labels[np.lexsort((labels, rows))]
+        tree = FlatFPTree.from_fitted(fip, (indptr, labels), counts)
+        self.__dict__.update(tree.__dict__)
+
     def __add_fitted_transaction(self, trx: FittedTransaction,*, count = 1):
         node = self.labels[trx[0]][0]
         
@@ -169,36 +530,187 @@ class FlatFPTree:
             support = self.support(node)
             if support > 0: paths.append((support, path))
         return paths
+
+    # conditional pattern base of label as CSR arrays: the labels above every node of label,
+    # and the support of the node. All the paths are walked up together, one level per step
+    def __conditional_base(self, label: int) -> ConditionalBase:
+        nodes = np.asarray(self.labels[label][1:], dtype=np.int64)
+        counts = self.node_supports[nodes].astype(np.int64)
+        nodes = nodes[counts > 0]
+        counts = counts[counts > 0]
+
+        rows = np.arange(len(nodes))
+        ancestors = self.node_parents[nodes]
+        level_rows: list[np.ndarray] = []
+        level_labels: list[np.ndarray] = []
+        while len(ancestors) > 0:
+            above = ancestors >= 0
+            rows = rows[above]
+            ancestors = ancestors[above]
+            level_rows.append(rows)
+            level_labels.append(self.node_labels[ancestors])
+            ancestors = self.node_parents[ancestors]
+
+        rows = np.concatenate(level_rows) if len(level_rows) > 0 else np.zeros(0, dtype=np.int64)
+        labels = np.concatenate(level_labels) if len(level_labels) > 0 else np.zeros(0, dtype=np.int32)
+        order = np.argsort(rows, kind='stable')
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(nodes)), out=indptr[1:])
+        return indptr, labels[order].astype(np.int64), counts
+
+    # preprocessor of the conditional tree of a base, set directly from the counts of its labels
+    # instead of fitted: its labels are the ranks of the frequent labels of this tree, by
+    # decreasing support as fit would sort them. The base is returned in those ranks, sorted,
+    # so it is ready to be inserted in the conditional tree
+    # supports of the labels in base are counted unless they are given
+    def __conditional_preprocessor(self, base: ConditionalBase, min_support: Optional[int] = None, supports: Optional[np.ndarray] = None) -> tuple[FrequentItemPreprocessor, ConditionalBase]:
+        min_support = self.fip.min_support if min_support is None else min_support
+        indptr, labels, counts = base
+        lengths = np.diff(indptr)
+        if supports is None:
+            supports = np.rint(np.bincount(
+                labels, weights=np.repeat(counts, lengths), minlength=self.fip.number_of_frequent_one_items
+            )).astype(np.int64)
+        # as in fit, labels missing from the base are not counted at all
+        frequent = np.flatnonzero((supports >= min_support) & (supports > 0))
+        order = frequent[np.lexsort((frequent, supports[frequent]))[::-1]]
+
+        fip = FrequentItemPreprocessor(min_support)
+        fip.set_frequent_items(order.tolist(), supports[order].tolist(), len(lengths))
+
+        # integer remap of this tree's labels to ranks, then every path is sorted by rank
+        ranks = np.full(len(supports), -1, dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        ranked = ranks[labels]
+        rows = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        width = max(len(order), 1)
+        keys = np.sort(rows[ranked >= 0] * width + ranked[ranked >= 0])
+        rows, ranked = np.divmod(keys, width)
+        ranked_indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(lengths)), out=ranked_indptr[1:])
+        return fip, (ranked_indptr, ranked.astype(np.int32), counts)
     
-    def project_and_mine_tree(self, label: int):
+    # itemsets ending with label, with at most max_len labels: every projection adds one
+    # label, so the projected tree is mined with one label less and none is built at max_len.
+    # itemsets must hold the required labels, which can only come from the ancestors of label:
+    # paths missing any of them are dropped and so is the projection if none is left.
+    # with pair supports the base of label is neither extracted when no ancestor is frequent
+    # with label, nor counted again
+    def project_and_mine_tree(self, label: int, max_len: Optional[int] = None, required: frozenset[int] = frozenset()) -> Iterator[tuple[int, list[int]]]:
         #print("Current label:" + str(self.fip.to_item(label)))
-        paths = self.__extract_paths_from_label(label)
-        #print("Computed paths:", paths)
-        paths_len = len(paths)
+        required = required.difference([label])
+        if any(other > label for other in required):
+            return
+        if len(required) == 0:
+            yield (self.fip.frequent_one_items[label].support, [label])
+        if max_len is not None and max_len <= len(required) + (1 if len(required) == 0 else 0):
+            return
+        supports = None
+        if self.pair_supports is not None:
+            supports = np.zeros(len(self.pair_supports), dtype=np.int64)
+            supports[:label] = self.pair_supports[label, :label]
+            if not (supports >= self.fip.min_support).any():
+                return
 
-        itemsets = [
-            (self.fip.frequent_one_items[label].support, [label])
-        ]
-        if paths_len == 1:
-            support, path = paths[0]
-            itemsets.append(
-                (support, path + [label])
-            )
-        elif len(paths) > 1:
-            fip, tree = self.__project_tree(paths)
-            for sup, path in tree.__extract_itemsets():
-                itemsets.append((sup, fip.to_items(path) + [label]))
-        
-        #print("Found itemsets: ",[(self.fip.to_items(path), supp) for supp, path in itemsets])
-        
-        return itemsets
+        indptr, labels, counts = self.__conditional_base(label)
+        if len(required) > 0:
+            supports = None
+            lengths = np.diff(indptr)
+            rows = np.repeat(np.arange(len(lengths)), lengths)
+            held = np.bincount(rows[np.isin(labels, list(required))], minlength=len(lengths))
+            kept = held == len(required)
+            labels = labels[np.repeat(kept, lengths)]
+            counts = counts[kept]
+            indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(lengths[kept], out=indptr[1:])
+        prefix_len = None if max_len is None else max_len - 1
 
-    def __project_tree(self, paths):
-        fip = FrequentItemPreprocessor(self.fip.min_support)
-        fip.fit([item for _, item in paths], [support for support, _ in paths])
-        tree = FlatFPTree(fip)
-        for support, trx in paths:
-            tree.add_transaction(trx, support)
+        for support, itemset in self.__mine_paths((indptr, labels, counts), prefix_len, required, supports):
+            yield (support, itemset + [label])
+
+    # frequent itemsets of a conditional pattern base, in the labels of this tree.
+    # when the conditional tree would start with a single path, the combinations of the path
+    # are enumerated directly and only the paths going on below it are projected: every
+    # itemset below the path joins every combination of the path with the same support
+    def __mine_paths(self, base: ConditionalBase, max_len: Optional[int] = None, required: frozenset[int] = frozenset(), supports: Optional[np.ndarray] = None) -> Iterator[tuple[int, list[int]]]:
+        fip, (indptr, ranks, counts) = self.__conditional_preprocessor(base, supports=supports)
+        order = [ foi.item for foi in fip.frequent_one_items ]
+        if len(order) == 0 or not required.issubset(fip.frequent_one_items_map):
+            return
+        lengths = np.diff(indptr)
+
+        # the single path is made of the first ranks, as long as every path goes through them.
+        # there is none when the most frequent label misses some path, which is the common case
+        single_len = 0
+        total = int(counts.sum())
+        if fip.frequent_one_items[0].support == total:
+            rows = np.repeat(np.arange(len(lengths)), lengths)
+            positions = np.arange(len(ranks)) - indptr[rows]
+            diverging = ranks != positions
+            first_diverging = np.full(len(lengths), lengths.max(), dtype=np.int64)
+            np.minimum.at(first_diverging, rows[diverging], positions[diverging])
+            single_len = int(first_diverging.min())
+
+        if single_len == 0:
+            tree = FlatFPTree.from_fitted(fip, (indptr, ranks), counts)
+            if max_len is None or max_len > 1:
+                tree.pair_supports = FlatFPTree.__pair_supports((indptr, ranks, counts), len(order))
+            tree_required = frozenset(fip.frequent_one_items_map[label] for label in required)
+            for support, itemset in tree.iter_itemsets(0, max_len=max_len, required=tree_required):
+                yield (support, fip.to_items(itemset))
+            return
+
+        # support of each node of the single path: the counts of the paths longer than its rank
+        longer = total - np.cumsum(np.rint(np.bincount(lengths, weights=counts)).astype(np.int64))
+        single_supports = longer[:single_len].tolist()
+        single_required = [ rank for rank in range(single_len) if order[rank] in required ]
+        rest_required = required.difference(order[:single_len])
+        rest_rows = lengths > single_len
+        rest_indptr = np.zeros(np.count_nonzero(rest_rows) + 1, dtype=np.int64)
+        np.cumsum(lengths[rest_rows] - single_len, out=rest_indptr[1:])
+        rest_ranks = ranks[np.repeat(rest_rows, lengths) & (positions >= single_len)]
+        rest = (rest_indptr, np.asarray(order, dtype=np.int64)[rest_ranks], counts[rest_rows])
+
+        if len(rest_required) == 0:
+            for combination in FlatFPTree.__path_combinations(single_len, single_required, max_len):
+                yield (single_supports[combination[-1]], [ order[rank] for rank in combination ])
+        rest_len = None if max_len is None else max_len - len(single_required)
+        if len(rest[2]) > 0 and (rest_len is None or rest_len > 0):
+            for support, itemset in self.__mine_paths(rest, rest_len, rest_required):
+                if len(single_required) == 0:
+                    yield (support, itemset)
+                combinations_len = None if max_len is None else max_len - len(itemset)
+                for combination in FlatFPTree.__path_combinations(single_len, single_required, combinations_len):
+                    yield (support, [ order[rank] for rank in combination ] + itemset)
+
+    # supports of all pairs of labels of a base at once: paths become the rows of a 0/1 matrix X
+    # over the labels and the supports are X^T W X, W the diagonal of the path counts. Row l of
+    # the result counts the labels of the base of l in a tree built from these paths (FP-array).
+    # with more labels than paths the tree is cheaper to mine than the labels x labels result
+    @staticmethod
+    def __pair_supports(base: ConditionalBase, width: int) -> Optional[np.ndarray]:
+        indptr, labels, counts = base
+        lengths = np.diff(indptr)
+        if width > len(lengths) or len(lengths) * width > PAIR_SUPPORTS_MAX_CELLS or width * width > PAIR_SUPPORTS_MAX_CELLS:
+            return None
+        # rows hold sqrt(W) X, so the product is one matrix by its own transpose, without a
+        # weighted copy: rounding keeps the sums of path counts exact
+        paths = np.zeros((len(lengths), width), dtype=np.float64)
+        paths[np.repeat(np.arange(len(lengths)), lengths), labels] = np.repeat(np.sqrt(counts), lengths)
+        return np.rint(paths.T @ paths).astype(np.int32)
+
+    # non empty combinations of the first ranks holding the required ones, with at most max_len ranks
+    @staticmethod
+    def __path_combinations(length: int, required: list[int], max_len: Optional[int]) -> Iterator[list[int]]:
+        optional = [ rank for rank in range(length) if rank not in required ]
+        longest = len(optional) if max_len is None else min(len(optional), max_len - len(required))
+        for optional_len in range(0 if len(required) > 0 else 1, longest + 1):
+            for combination in itertools.combinations(optional, optional_len):
+                yield sorted(required + list(combination))
+
+    def __project_tree(self, base: ConditionalBase, min_support: Optional[int] = None):
+        fip, (indptr, ranks, counts) = self.__conditional_preprocessor(base, min_support)
+        tree = FlatFPTree.from_fitted(fip, (indptr, ranks), counts)
         return fip,tree
         ##fip = FrequentItemPreprocessor(min_support=0)
         ##paths = []
@@ -227,6 +739,34 @@ class FlatFPTree:
         ##    return []
         ##return []
 
+    # the k most frequent itemsets with at least min_len labels, by decreasing support.
+    # once k itemsets are found the k-th support becomes the threshold, labels are visited
+    # by decreasing support so the first one that cannot beat it ends the search
+    def topk_itemsets(self, k: int, min_len: int = 1) -> list[tuple[int, list[int]]]:
+        heap: list[tuple[int, list[int]]] = []
+        if k > 0:
+            self.__mine_topk(heap, k, min_len, [], list(range(self.fip.number_of_frequent_one_items)))
+        return sorted(heap, key = lambda entry: entry[0], reverse=True)
+
+    # to_root maps the labels of this tree to the labels of the tree mining started from
+    def __mine_topk(self, heap: list[tuple[int, list[int]]], k: int, min_len: int, suffix: list[int], to_root: list[int]):
+        for label in range(self.fip.number_of_frequent_one_items):
+            support = self.fip.frequent_one_items[label].support
+            if len(heap) == k and support <= heap[0][0]:
+                break
+            itemset = [to_root[label]] + suffix
+            if len(itemset) >= min_len:
+                if len(heap) < k:
+                    heapq.heappush(heap, (support, itemset))
+                else:
+                    heapq.heapreplace(heap, (support, itemset))
+
+            base = self.__conditional_base(label)
+            if len(base[2]) > 0:
+                min_support = heap[0][0] + 1 if len(heap) == k else self.fip.min_support
+                fip, tree = self.__project_tree(base, min_support)
+                tree.__mine_topk(heap, k, min_len, itemset, [ to_root[fip.to_item(child)] for child in range(fip.number_of_frequent_one_items) ])
+
     def __projected_extract_itemsets(self, label: int):
         scale = self.fip.transactions_scale
         itemsets = [
@@ -241,7 +781,7 @@ class FlatFPTree:
 
     def __prune_zero_support_nodes(self):
         self.labels = [
-            [ node for node in nodes if self.node_supports[node] > 0] for nodes in self.labels
+            [ node for node in nodes if self.support(node) > 0] for nodes in self.labels
         ]
 
     def __prune_less_than_minsup_nodes(self):
@@ -250,41 +790,399 @@ class FlatFPTree:
             [ node for node in nodes if self.support(node) > min_support] for nodes in self.labels
         ]
     
-    def extract_itemsets(self, max_workers: int):
+    def extract_itemsets(self, max_workers: int, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: Iterable[int] = (), executor: Optional[str] = None, pool: Optional[concurrent.futures.Executor] = None):
+        return list(self.iter_itemsets(max_workers, mode, min_len, max_len, required, executor, pool))
+
+    # yields (support, labels) pairs as soon as they are mined, with workers
+    # results are handed over batch by batch.
+    # mode is 'all' for every frequent itemset, 'closed' for those without a superset of the
+    # same support and 'maximal' for those without a frequent superset. Closed and maximal
+    # itemsets are only yielded once every label is mined, since any branch can subsume them.
+    # min_len and max_len bound the number of labels of every itemset, with mode 'all' only.
+    # only itemsets holding every required label are yielded, and only the labels after
+    # the last required one are mined: no other label ends such an itemset.
+    # executor runs the workers as 'thread's sharing this tree, as 'process'es attached to a
+    # shared memory copy of it, or mines 'serial'ly; by default see default_executor.
+    # pool is an executor of that kind kept by the caller (see Miner), a new one is used otherwise
+    def iter_itemsets(self, max_workers: int, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: Iterable[int] = (), executor: Optional[str] = None, pool: Optional[concurrent.futures.Executor] = None) -> Iterator[tuple[int, list[int]]]:
         # self.__prune_zero_support_nodes()
+        if mode not in ITEMSET_MODES:
+            raise ValueError(f"mode must be one of {', '.join(ITEMSET_MODES)}")
+        if mode != 'all' and (min_len > 1 or max_len is not None):
+            raise ValueError("length limits only apply to mode 'all'")
+        executor = default_executor(max_workers) if executor is None else executor
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor must be one of {', '.join(EXECUTORS)}")
 
-        if max_workers > 0:
-            return self.__extract_itemsets_mp(max_workers)
+        required = frozenset(required)
+        if max_workers > 0 and executor != 'serial':
+            itemsets = self.__iter_itemsets_mp(max_workers, mode, min_len, max_len, required, executor, pool)
         else:
-            return self.__extract_itemsets()
+            itemsets = self.__iter_itemsets(mode, min_len, max_len, required)
+        if mode == 'all':
+            return itemsets
+        # supersets of an itemset holding the required labels hold them as well,
+        # so the other candidates are not needed to condense these ones
+        return (
+            (support, labels) for support, labels in condense_itemsets(itemsets, mode)
+                if required.issubset(labels)
+        )
 
-    def __extract_itemsets(self):
-        itemsets = []
-        for label in range(self.fip.number_of_frequent_one_items):
-            itemsets += self.project_and_mine_tree(label)
-        return itemsets
-    def __extract_itemsets_mp(self, max_workers: int):
-        itemsets = []
-        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=mp_init_worker, initargs=tuple([self])) as executor:
-            labels = np.arange(self.fip.number_of_frequent_one_items)
-            np.random.shuffle(labels)
-            grid = np.array_split(labels,max_workers)
-            futures = {
-                executor.submit(mp_run, list(labels))
-                for labels in grid
-            }
-            for fut in concurrent.futures.as_completed(futures):
-                result = fut.result()
-                itemsets += (result)
-        return itemsets
+    def __iter_itemsets(self, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: frozenset[int] = frozenset()):
+        for label in range(max(required, default=0), self.fip.number_of_frequent_one_items):
+            yield from self.mine_label(label, mode, min_len, max_len, required)
+
+    def __iter_itemsets_mp(self, max_workers: int, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: frozenset[int] = frozenset(), executor: str = 'process', pool: Optional[concurrent.futures.Executor] = None):
+        if executor == 'thread':
+            # mining only reads the tree, every projection builds trees of its own
+            shm, run = None, self.mine_labels
+            owned = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) if pool is None else None
+        else:
+            # every batch names the shared tree, a worker attaches to it on its first batch
+            shm, shared = self.share()
+            run = functools.partial(mp_run, shared)
+            owned = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) if pool is None else None
+        # a pool kept by the caller is not shut down, its batches still queued are cancelled
+        futures = set()
+        try:
+            with owned if owned is not None else contextlib.nullcontext(pool) as executor:
+                # heaviest batches are queued first, idle workers keep pulling the next one
+                first = max(required, default=0)
+                grid = (
+                    batch for batch in (
+                        [ label for label in labels if label >= first ]
+                        for labels in schedule_labels(self.label_costs(), max_workers)
+                    ) if len(batch) > 0
+                )
+                # only a bounded number of batches is in flight, so results do not
+                # pile up faster than the consumer drains them
+                futures = {
+                    executor.submit(run, labels, mode, min_len, max_len, required)
+                    for labels in itertools.islice(grid, 2 * max_workers)
+                }
+                while len(futures) > 0:
+                    done, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for labels in itertools.islice(grid, len(done)):
+                        futures.add(executor.submit(run, labels, mode, min_len, max_len, required))
+                    for fut in done:
+                        yield from fut.result()
+        finally:
+            for fut in futures:
+                fut.cancel()
+            if shm is not None:
+                # batches of a kept pool already running still attach to the segment, it is
+                # only unlinked once they are done
+                concurrent.futures.wait(futures)
+                shm.close()
+                shm.unlink()
+
+    # itemsets of a batch of labels, as a worker returns them
+    def mine_labels(self, labels: list[int], mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: frozenset[int] = frozenset()) -> list[tuple[int, list[int]]]:
+        result = []
+        for label in labels:
+            result += self.mine_label(label, mode, min_len, max_len, required)
+        return result
+
+    # itemsets whose last label is label, see iter_itemsets for the modes and length limits
+    def mine_label(self, label: int, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: frozenset[int] = frozenset()) -> Iterator[tuple[int, list[int]]]:
+        if mode == 'all':
+            itemsets = self.project_and_mine_tree(label, max_len, required)
+            return itemsets if min_len <= 1 else ( (support, labels) for support, labels in itemsets if len(labels) >= min_len )
+        found = SupersetIndex(by_support = mode == 'closed')
+        self.__mine_condensed(
+            found, mode == 'maximal', frozenset([label]), self.fip.frequent_one_items[label].support,
+            self.__conditional_base(label), list(range(self.fip.number_of_frequent_one_items))
+        )
+        return ( (support, sorted(itemset)) for support, itemset in found )
+
+    # closed itemsets merge the items found in every path of their conditional base (CLOSET+)
+    # and their branch is dropped when a superset with the same support was found before;
+    # maximal branches are dropped when all of their items fit in a maximal itemset found
+    # before (FPMax). Checks only see the itemsets of the same branch, so results are
+    # candidates, condense_itemsets drops those subsumed by other branches.
+    # to_root maps the labels of this tree to the labels of the tree mining started from
+    def __mine_condensed(self, found: 'SupersetIndex', maximal: bool, itemset: frozenset[int], support: int, base: ConditionalBase, to_root: list[int]):
+        fip, (indptr, ranks, counts) = self.__conditional_preprocessor(base)
+        items = [ to_root[foi.item] for foi in fip.frequent_one_items ]
+
+        if maximal:
+            if found.has_superset(itemset.union(items), support):
+                return
+        else:
+            itemset = itemset.union(
+                items[foi.label] for foi in fip.frequent_one_items if foi.support == support
+            )
+            if found.has_superset(itemset, support):
+                return
+            found.add(support, itemset)
+
+        extensions = [ foi for foi in fip.frequent_one_items if items[foi.label] not in itemset ]
+        if len(extensions) == 0:
+            if maximal:
+                found.add(support, itemset)
+            return
+
+        tree = FlatFPTree.from_fitted(fip, (indptr, ranks), counts)
+        # least frequent labels first, their itemsets are the largest ones
+        for foi in reversed(extensions):
+            tree.__mine_condensed(found, maximal, itemset.union([items[foi.label]]), foi.support, tree.__conditional_base(foi.label), items)
+
+    # number of edges between each node and its root, computed by pointer jumping
+    def node_depths(self) -> np.ndarray:
+        parents = self.node_parents[:self.node_next]
+        depths = (parents >= 0).astype(np.int32)
+        jumps = parents.copy()
+        valid = jumps >= 0
+        while valid.any():
+            depths[valid] += depths[jumps[valid]]
+            jumps[valid] = jumps[jumps[valid]]
+            valid = jumps >= 0
+        return depths
+
+    # estimated cost of mining each label: total length of its conditional pattern base,
+    # that is header list length times average path depth
+    def label_costs(self) -> np.ndarray:
+        used = (self.node_supports[:self.node_next] > 0) & (self.node_parents[:self.node_next] >= 0)
+        return np.bincount(
+            self.node_labels[:self.node_next][used],
+            weights=self.node_depths()[used],
+            minlength=self.fip.number_of_frequent_one_items
+        )[:self.fip.number_of_frequent_one_items]
+
+    # publishes the node arrays and the header lists into a single shared memory
+    # segment, the caller owns the segment and must unlink it when done
+    def share(self) -> tuple[multiprocessing.shared_memory.SharedMemory, SharedFlatFPTree]:
+        node_count = self.node_next
+        header_indptr, header_nodes = self.__header_arrays()
+        header_count = len(header_nodes)
+
+        shared = SharedFlatFPTree(
+            name='', node_count=node_count, header_count=header_count, label_count=self.fip.number_of_frequent_one_items,
+            min_support=self.fip.min_support, transactions_count=self.fip.transactions_count
+        )
+        size = 4 * (6 * node_count + len(header_indptr) + header_count + shared.label_count)
+        shm = multiprocessing.shared_memory.SharedMemory(create=True, size=max(size, 1))
+        shared.name = shm.name
+
+        arrays = FlatFPTree.__shared_arrays(shm, shared)
+        for name, array in self.node_arrays().items():
+            arrays[name][:] = array
+        arrays['header_indptr'][:] = header_indptr
+        arrays['header_nodes'][:] = header_nodes
+        arrays['label_supports'][:] = [ foi.support for foi in self.fip.frequent_one_items ]
+        return shm, shared
+
+    # header lists as CSR arrays
+    def __header_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        header_indptr = np.zeros(len(self.labels) + 1, dtype=np.int32)
+        np.cumsum([len(nodes) for nodes in self.labels], out=header_indptr[1:])
+        header_nodes = np.concatenate([ np.asarray(nodes, dtype=np.int32) for nodes in self.labels ]) \
+            if len(self.labels) > 0 else np.zeros(0, dtype=np.int32)
+        return header_indptr, header_nodes
+
+    # whether save can write this tree: items that are not integers are written as JSON,
+    # so they must come back from it unchanged (strings, floats, bools, but not tuples)
+    def can_save(self) -> bool:
+        return self.__encoded_items() is not None
+
+    def __encoded_items(self) -> Optional[np.ndarray]:
+        items = item_array([ foi.item for foi in self.fip.frequent_one_items ])
+        if items.dtype.kind != 'O':
+            return items
+        decoded = json.loads(json.dumps(items.tolist()))
+        if any(type(item) is not type(back) or item != back for item, back in zip(items.tolist(), decoded)):
+            return None
+        return items
+
+    # saves the node arrays, the header lists and the preprocessor state in a .npz file
+    def save(self, path: str | os.PathLike) -> None:
+        items = self.__encoded_items()
+        if items is None:
+            raise ValueError("items must be integers, or values that JSON stores unchanged, to save the tree")
+        # items that are not integers are stored as JSON, as the dictionary of binary
+        # transaction files, so that loading never unpickles anything
+        items_field = { 'items': items } if items.dtype.kind != 'O' else \
+            { 'items_json': np.frombuffer(json.dumps(items.tolist()).encode(), dtype=np.uint8) }
+        header_indptr, header_nodes = self.__header_arrays()
+        np.savez(
+            path,
+            **self.node_arrays(),
+            header_indptr=header_indptr,
+            header_nodes=header_nodes,
+            **items_field,
+            item_supports=np.array([ foi.support for foi in self.fip.frequent_one_items ], dtype=np.int64),
+            min_support=self.fip.min_support,
+            transactions_count=self.fip.transactions_count,
+        )
+
+    # loads a tree written by save
+    @classmethod
+    def load(cls, path: str | os.PathLike) -> Self:
+        with np.load(path, allow_pickle=False) as arrays:
+            fip = FrequentItemPreprocessor(int(arrays['min_support']))
+            items = json.loads(arrays['items_json'].tobytes()) if 'items_json' in arrays else arrays['items'].tolist()
+            fip.set_frequent_items(items, arrays['item_supports'].tolist(), int(arrays['transactions_count']))
+
+            tree = cls.__new__(cls)
+            tree.fip = fip
+            tree.pair_supports = None
+            tree.node_next = len(arrays['labels'])
+            tree.node_capacity = tree.node_next
+            for name in NODE_FIELDS:
+                setattr(tree, 'node_' + name, arrays[name].astype(np.int32))
+            header_indptr = arrays['header_indptr']
+            tree.labels = [ nodes.tolist() for nodes in np.split(arrays['header_nodes'], header_indptr[1:-1]) ] \
+                if len(header_indptr) > 1 else []
+        tree.__bind_views()
+        return tree
+
+    # the same tree mined at a higher threshold: frequent labels at the higher threshold
+    # are a prefix of the current ones and only have frequent ancestors, so the nodes of
+    # the labels left out are never reached. Node buffers are shared with this tree
+    def with_min_support(self, min_support: int) -> Self:
+        tree = copy.copy(self)
+        tree.fip = self.fip.with_min_support(min_support)
+        tree.labels = self.labels[:tree.fip.number_of_frequent_one_items]
+        return tree
+
+    # builds a tree over a segment published by `share` without copying it,
+    # the returned segment must be kept alive as long as the tree is used
+    @staticmethod
+    # the attached tree labels its items by their labels, its preprocessor is rebuilt from
+    # the label supports unless the one of a previous attach is given
+    def attach(shared: SharedFlatFPTree, fip: Optional[FrequentItemPreprocessor] = None) -> tuple[multiprocessing.shared_memory.SharedMemory, Self]:
+        shm = attach_segment(shared.name)
+        arrays = FlatFPTree.__shared_arrays(shm, shared)
+        if fip is None:
+            fip = FrequentItemPreprocessor(shared.min_support)
+            fip.set_frequent_items(list(range(shared.label_count)), arrays['label_supports'].tolist(), shared.transactions_count)
+
+        tree = FlatFPTree.__new__(FlatFPTree)
+        tree.fip = fip
+        tree.pair_supports = None
+        tree.node_next = shared.node_count
+        tree.node_capacity = shared.node_count
+        for name in NODE_FIELDS:
+            setattr(tree, 'node_' + name, arrays[name])
+        header_indptr = arrays['header_indptr']
+        tree.labels = [
+            arrays['header_nodes'][header_indptr[label]:header_indptr[label + 1]]
+            for label in range(len(header_indptr) - 1)
+        ]
+        tree.__bind_views()
+        return shm, tree
+
+    @staticmethod
+    def __shared_arrays(shm: multiprocessing.shared_memory.SharedMemory, shared: SharedFlatFPTree) -> dict[str, np.ndarray]:
+        lengths = [ (name, shared.node_count) for name in NODE_FIELDS ] + [
+            ('header_indptr', shared.label_count + 1),
+            ('header_nodes', shared.header_count),
+            ('label_supports', shared.label_count),
+        ]
+        arrays = dict()
+        offset = 0
+        for name, length in lengths:
+            arrays[name] = np.ndarray(length, dtype=np.int32, buffer=shm.buf, offset=offset)
+            offset += 4 * length
+        return arrays
+
+# segments are owned by the process creating them, which unlinks them. From 3.13 attaching
+# workers leave them untracked; before, their resource tracker must be the one of the owner
+# (see Miner), or it reports the segments as leaked once the owner unlinked them
+def attach_segment(name: str) -> multiprocessing.shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return multiprocessing.shared_memory.SharedMemory(name=name, track=False)
+    return multiprocessing.shared_memory.SharedMemory(name=name)
+
+# threads share the tree with no copy, but they only mine in parallel when the interpreter
+# runs without a GIL (free-threaded builds); otherwise processes do
+def default_executor(max_workers: int) -> str:
+    if max_workers <= 0:
+        return 'serial'
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)
+    return 'process' if is_gil_enabled() else 'thread'
+
+# splits labels into small batches ordered by decreasing estimated cost,
+# expensive labels get a batch of their own while cheap ones are grouped together
+def schedule_labels(costs: np.ndarray, max_workers: int, batches_per_worker: int = 8) -> list[list[int]]:
+    order = np.argsort(-costs, kind='stable')
+    target = costs.sum() / max(1, max_workers * batches_per_worker)
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    batch_cost = 0
+    for label in order.tolist():
+        batch.append(label)
+        batch_cost += costs[label]
+        if batch_cost >= target:
+            batches.append(batch)
+            batch = []
+            batch_cost = 0
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+# itemsets found so far, indexed for superset queries. Itemsets are grouped by support when
+# only supersets with the same support matter, in each group bit i of bits[item] is set when
+# the i-th itemset holds item, so the supersets of an itemset are the and of its items' bits
+class SupersetIndex:
+    by_support: bool
+    itemsets: list[tuple[int, frozenset[int]]]
+    groups: dict[Optional[int], tuple[int, dict[int, int]]]
+
+    def __init__(self, by_support: bool):
+        self.by_support = by_support
+        self.itemsets = []
+        self.groups = dict()
+
+    def __iter__(self):
+        return iter(self.itemsets)
+
+    # bit of the new itemset in its group
+    def add(self, support: int, itemset: frozenset[int]) -> int:
+        self.itemsets.append((support, itemset))
+        key = support if self.by_support else None
+        count, bits = self.groups.get(key, (0, dict()))
+        for item in itemset:
+            bits[item] = bits.get(item, 0) | (1 << count)
+        self.groups[key] = (count + 1, bits)
+        return 1 << count
+
+    # bits of the itemsets holding itemset, itemset included, in the group of support
+    def supersets(self, itemset: Iterable[int], support: int) -> int:
+        count, bits = self.groups.get(support if self.by_support else None, (0, dict()))
+        mask = (1 << count) - 1
+        for item in itemset:
+            if mask == 0:
+                break
+            mask &= bits.get(item, 0)
+        return mask
+
+    def has_superset(self, itemset: Iterable[int], support: int) -> bool:
+        return self.supersets(itemset, support) != 0
+
+# keeps the closed or maximal itemsets among candidates mined label by label
+def condense_itemsets(itemsets: Iterable[tuple[int, list[int]]], mode: str) -> Iterator[tuple[int, list[int]]]:
+    index = SupersetIndex(by_support = mode == 'closed')
+    candidates = { frozenset(labels): support for support, labels in itemsets }
+    bits = [ index.add(support, itemset) for itemset, support in candidates.items() ]
+    for bit, (support, itemset) in zip(bits, index):
+        if index.supersets(itemset, support) & ~bit == 0:
+            yield (support, sorted(itemset))
 
-def mp_init_worker(tree_: FlatFPTree):
-    global tree
-    tree = tree_
-def mp_run(labels: list[int]):
-    global tree
-    result = []
-    for label in labels:
-        result += tree.project_and_mine_tree(label)
-    return result
+def mp_build(fip: FrequentItemPreprocessor, indptr: np.ndarray, labels: np.ndarray, counts: np.ndarray):
+    tree = FlatFPTree.from_fitted(fip, (indptr, labels), counts)
+    return { **tree.node_arrays(), 'depths': tree.node_depths() }
 
+# the segment is only mapped while a batch is mined, so idle workers of a kept pool hold no
+# tree; the preprocessor of the last tree is kept, its next batches skip rebuilding it
+tree_fip: Optional[tuple[str, FrequentItemPreprocessor]] = None
+def mp_run(shared: SharedFlatFPTree, labels: list[int], mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: frozenset[int] = frozenset()):
+    global tree_fip
+    shm, tree = FlatFPTree.attach(shared, tree_fip[1] if tree_fip is not None and tree_fip[0] == shared.name else None)
+    tree_fip = (shared.name, tree.fip)
+    try:
+        return tree.mine_labels(labels, mode, min_len, max_len, required)
+    finally:
+        # the views of the tree must be gone before its segment is closed
+        del tree
+        shm.close()
@@ -1,6 +1,9 @@
+import itertools
 from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Hashable, Optional, Sequence
+from typing import Hashable, Iterable, Optional, Self, Sequence
+
+import numpy as np
 
 
 @dataclass 
@@ -12,14 +15,55 @@ class FrequentOneItem:
 type Transaction = list[Hashable]
 type FittedTransaction = list[int]
 
+# packs transactions into CSR arrays: the items of transaction i are items[indptr[i]:indptr[i+1]]
+def to_csr(transactions: Sequence[Transaction]) -> tuple[np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(transactions) + 1, dtype=np.int64)
+    np.cumsum([len(trx) for trx in transactions], out=indptr[1:])
+    return indptr, item_array(list(itertools.chain.from_iterable(transactions)))
+
+# items as a 1-D array: plain integers get an int64 array, anything else is kept as is in an
+# object array, since numpy would turn bools into integers, tuples into rows and mixed items into strings
+def item_array(items: list[Hashable]) -> np.ndarray:
+    if set(map(type, items)) <= {int}:
+        try:
+            return np.fromiter(items, dtype=np.int64, count=len(items))
+        except OverflowError:
+            pass
+    return np.fromiter(items, dtype=object, count=len(items))
+
+# distinct items and the code of every item among them, as np.unique with return_inverse.
+# object items are coded with a dict in order of appearance: mixed items, such as strings
+# and integers, cannot be sorted
+def unique_codes(items: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    items = np.asarray(items)
+    if items.dtype.kind != 'O':
+        unique_items, codes = np.unique(items, return_inverse=True)
+        return unique_items, codes.reshape(-1)
+    seen: dict = dict()
+    codes = np.fromiter((seen.setdefault(item, len(seen)) for item in items.tolist()), dtype=np.int64, count=len(items))
+    unique_items = np.empty(len(seen), dtype=object)
+    for code, item in enumerate(seen):
+        unique_items[code] = item
+    return unique_items, codes
+
+# key breaking ties of support between items: items of different types, that cannot be
+# compared, are ordered by type name first
+def tie_key(item: Hashable) -> tuple[str, Hashable]:
+    return type(item).__name__, item
+
 class FrequentItemPreprocessor:
     min_support: int
     number_of_frequent_one_items: int
     frequent_one_items: list[FrequentOneItem]
     frequent_one_items_map: dict[Hashable, int]
+    missed_supports: dict[Hashable, int]
+    excluded_items: frozenset[Hashable]
     
-    def __init__(self,min_support: int):
+    # excluded items never get a label, as if they were not in any transaction
+    def __init__(self,min_support: int, excluded_items: Iterable[Hashable] = ()):
         self.min_support = min_support
+        self.missed_supports = dict()
+        self.excluded_items = frozenset(excluded_items)
     
     def fit(self, transactions: list[Transaction], supports: Optional[list[int]] = None):
         transactions_count: int = 0
@@ -38,8 +82,8 @@ class FrequentItemPreprocessor:
                 support=support
             ) 
             for ( item, support ) in frequent_one_item_supports.items()
-                if  self.min_support <= support
-        ], reverse=True, key = lambda foi: (foi.support , foi.item) )
+                if  self.min_support <= support and item not in self.excluded_items
+        ], reverse=True, key = lambda foi: (foi.support , tie_key(foi.item)) )
         
         self.frequent_one_items_map = dict()
 
@@ -51,9 +95,193 @@ class FrequentItemPreprocessor:
         self.transactions_count = transactions_count
         self.number_of_frequent_one_items = len(self.frequent_one_items)
     
+    # same as fit, over transactions stored as CSR arrays (see to_csr)
+    def fit_csr(self, indptr: np.ndarray, items: np.ndarray, supports: Optional[np.ndarray] = None):
+        unique_items, item_supports = FrequentItemPreprocessor.__count_csr(indptr, items, supports)
+        self.__select_frequent(unique_items, item_supports, len(indptr) - 1)
+
+    # same as fit_csr over a sequence of CSR chunks, only the per item counters are kept in memory
+    def fit_csr_chunks(self, chunks: Iterable[tuple[np.ndarray, np.ndarray]]):
+        unique_items: Optional[np.ndarray] = None
+        item_supports = np.zeros(0, dtype=np.int64)
+        transactions_count = 0
+        for indptr, items in chunks:
+            chunk_items, chunk_supports = FrequentItemPreprocessor.__count_csr(indptr, items, None)
+            if unique_items is None:
+                unique_items, item_supports = chunk_items, chunk_supports
+            else:
+                unique_items, codes = unique_codes(np.concatenate([unique_items, chunk_items]))
+                item_supports = np.bincount(codes, weights=np.concatenate([item_supports, chunk_supports]), minlength=len(unique_items))
+                item_supports = np.rint(item_supports).astype(np.int64)
+            transactions_count += len(indptr) - 1
+        if unique_items is None:
+            unique_items = np.zeros(0, dtype=np.int64)
+        self.__select_frequent(unique_items, item_supports, transactions_count)
+
+    # the frequent items at a higher threshold are a prefix of the current labels,
+    # so the returned preprocessor labels every item exactly as this one
+    def with_min_support(self, min_support: int) -> Self:
+        if min_support < self.min_support:
+            raise ValueError("min_support can only be raised")
+        if not self.is_ordered(min_support):
+            raise ValueError("items reaching min_support are not the first labels, reorder first")
+        fip = FrequentItemPreprocessor(min_support, self.excluded_items)
+        frequent = [ foi for foi in self.frequent_one_items if foi.support >= min_support ]
+        fip.set_frequent_items([ foi.item for foi in frequent ], [ foi.support for foi in frequent ], self.transactions_count)
+        return fip
+
+    # whether the items reaching min_support are exactly the first labels,
+    # always true right after fitting
+    def is_ordered(self, min_support: int) -> bool:
+        frequent = sum(foi.support >= min_support for foi in self.frequent_one_items)
+        return all(foi.support >= min_support for foi in self.frequent_one_items[:frequent])
+
+    # counts the items of appended transactions, labels are left as they are.
+    # items without a label are counted apart since they are not in any tree, see covers.
+    # a negative count takes back transactions counted before
+    def update_csr(self, indptr: np.ndarray, items: np.ndarray, count: int = 1):
+        unique_items, item_supports = FrequentItemPreprocessor.__count_csr(indptr, items, None)
+        for item, support in zip(unique_items.tolist(), (count * item_supports).tolist()):
+            label = self.frequent_one_items_map.get(item)
+            if item in self.excluded_items:
+                continue
+            if label is None:
+                self.missed_supports[item] = self.missed_supports.get(item, 0) + support
+            else:
+                self.frequent_one_items[label].support += support
+        self.transactions_count += count * (len(indptr) - 1)
+
+    # labels the given items after the current ones, items that already have a label are skipped
+    def add_items(self, items: Iterable[Hashable]) -> None:
+        for item in items:
+            if item in self.frequent_one_items_map or item in self.excluded_items:
+                continue
+            label = len(self.frequent_one_items)
+            self.frequent_one_items.append(FrequentOneItem(item=item, label=label, support=self.missed_supports.pop(item, 0)))
+            self.frequent_one_items_map[item] = label
+        self.number_of_frequent_one_items = len(self.frequent_one_items)
+
+    # whether every item that can reach min_support has a label: items left out by fit
+    # had less than self.min_support, plus whatever appended transactions gave them
+    def covers(self, min_support: int) -> bool:
+        return min_support >= self.min_support + max(self.missed_supports.values(), default=0)
+
+    # fraction of consecutive labels whose supports are out of order
+    def order_drift(self) -> float:
+        supports = np.array([ foi.support for foi in self.frequent_one_items ])
+        if len(supports) < 2:
+            return 0.0
+        return float(np.mean(supports[1:] > supports[:-1]))
+
+    # the same items and supports labelled by decreasing support, as in fit, along with the
+    # new label of every current label. Items left without support, whose transactions were
+    # all taken back, lose their label (-1): add_items labels them again if they come back
+    def reordered(self) -> tuple[Self, np.ndarray]:
+        order = sorted(self.frequent_one_items, reverse=True, key = lambda foi: (foi.support, tie_key(foi.item)))
+        order = [ foi for foi in order if foi.support > 0 ]
+        fip = FrequentItemPreprocessor(self.min_support, self.excluded_items)
+        fip.set_frequent_items([ foi.item for foi in order ], [ foi.support for foi in order ], self.transactions_count)
+        fip.missed_supports = dict(self.missed_supports)
+        relabel = np.full(len(self.frequent_one_items), -1, dtype=np.int32)
+        relabel[[ foi.label for foi in order ]] = np.arange(len(order), dtype=np.int32)
+        return fip, relabel
+
+    # distinct items and their supports, each item is counted once per transaction
+    @staticmethod
+    def __count_csr(indptr: np.ndarray, items: np.ndarray, supports: Optional[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+        indptr = np.asarray(indptr)
+        items = np.asarray(items)
+        transactions_count = len(indptr) - 1
+        rows = np.repeat(np.arange(transactions_count, dtype=np.int64), np.diff(indptr))
+
+        # items are coded into 0..n-1, then (row, code) pairs are deduplicated
+        unique_items, codes = unique_codes(items)
+        items_count = len(unique_items)
+        pairs = np.sort(rows * items_count + codes)
+        pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+        rows, codes = np.divmod(pairs, max(items_count, 1))
+
+        if supports is None:
+            item_supports = np.bincount(codes, minlength=items_count)
+        else:
+            weights = np.asarray(supports)[rows]
+            item_supports = np.bincount(codes, weights=weights, minlength=items_count)
+            if weights.dtype.kind in 'iub':
+                item_supports = np.rint(item_supports).astype(np.int64)
+        return unique_items, item_supports
+
+    def __select_frequent(self, unique_items: np.ndarray, item_supports: np.ndarray, transactions_count: int):
+        # decreasing support, ties broken by decreasing item, as in fit
+        frequent = np.flatnonzero(item_supports >= self.min_support)
+        if len(self.excluded_items) > 0:
+            frequent = np.array([ i for i in frequent.tolist() if unique_items[i] not in self.excluded_items ], dtype=np.int64)
+        if unique_items.dtype.kind == 'O':
+            order = np.array(sorted(frequent.tolist(), reverse=True, key = lambda i: (item_supports[i], tie_key(unique_items[i]))), dtype=np.int64)
+        else:
+            order = frequent[np.lexsort((unique_items[frequent], item_supports[frequent]))[::-1]]
+        self.set_frequent_items(unique_items[order].tolist(), item_supports[order].tolist(), transactions_count)
+
+    # sets the frequent items directly, items[label] is the item with that label
+    def set_frequent_items(self, items: list[Hashable], supports: list[int], transactions_count: int):
+        self.frequent_one_items = [
+            FrequentOneItem(item=item, label=label, support=support)
+            for label, (item, support) in enumerate(zip(items, supports))
+        ]
+        self.frequent_one_items_map = dict(zip(items, range(len(items))))
+
+        self.transactions_count = transactions_count
+        self.number_of_frequent_one_items = len(self.frequent_one_items)
+
     def transform(self, transaction: Transaction) -> FittedTransaction:
         return sorted([ self.frequent_one_items_map[item] for item in frozenset(transaction) if item in self.frequent_one_items_map])
 
+    # labels of the given items, -1 for items that are not frequent
+    def lookup(self, items: np.ndarray) -> np.ndarray:
+        items = items if isinstance(items, np.ndarray) else item_array(list(items))
+        frequent_items = item_array([ foi.item for foi in self.frequent_one_items ])
+        labels = np.full(len(items), -1, dtype=np.int32)
+        if len(frequent_items) == 0 or len(items) == 0:
+            return labels
+        if items.dtype.kind in 'iu' and frequent_items.dtype.kind in 'iu' \
+                and frequent_items.min() >= 0 and frequent_items.max() < 1 << 24:
+            # small non negative integers: dense lookup table
+            table = np.full(frequent_items.max() + 1, -1, dtype=np.int32)
+            table[frequent_items] = np.arange(len(frequent_items), dtype=np.int32)
+            in_range = (items >= 0) & (items < len(table))
+            labels[in_range] = table[items[in_range]]
+            return labels
+        if frequent_items.dtype.kind not in 'iub' or items.dtype.kind not in 'iub':
+            # strings or objects, which can be of mixed types (numpy turns those into strings
+            # and cannot sort them): hash lookups
+            return np.fromiter(
+                (self.frequent_one_items_map.get(item, -1) for item in items.tolist()), dtype=np.int32, count=len(items)
+            )
+        # other integers: binary search over the sorted frequent items
+        order = np.argsort(frequent_items, kind='stable')
+        positions = np.searchsorted(frequent_items[order], items).clip(0, len(order) - 1)
+        found = frequent_items[order][positions] == items
+        labels[found] = order[positions[found]]
+        return labels
+
+    # transform over a whole CSR dataset at once: returns a CSR matrix with the same rows,
+    # holding the sorted, deduplicated labels of each transaction's frequent items
+    def transform_batch(self, indptr: np.ndarray, items: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        indptr = np.asarray(indptr)
+        transactions_count = len(indptr) - 1
+        labels = self.lookup(items).astype(np.int64)
+        rows = np.repeat(np.arange(transactions_count, dtype=np.int64), np.diff(indptr))
+        frequent = labels >= 0
+        labels_count = max(self.number_of_frequent_one_items, 1)
+
+        # sorting on (row, label) sorts every segment, then duplicates are adjacent
+        keys = np.sort(rows[frequent] * labels_count + labels[frequent])
+        keys = keys[np.diff(keys, prepend=-1) != 0]
+        rows, labels = np.divmod(keys, labels_count)
+
+        fitted_indptr = np.zeros(transactions_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=transactions_count), out=fitted_indptr[1:])
+        return fitted_indptr, labels.astype(np.int32)
+
     def fit_transform(self, transactions: Sequence[Transaction]):
         self.fit(transactions)
         return [ self.transform(trx) for trx in transactions ]
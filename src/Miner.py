@@ -0,0 +1,64 @@
+import concurrent.futures
+import multiprocessing.resource_tracker
+import os
+import sys
+from typing import Hashable, Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from .FlatFPTree import EXECUTORS, default_executor
+from .FrequentItemPreprocessor import Transaction
+from .TreeCache import TreeCache
+from .fpgrowth import fpgrowth_csr, fpgrowth_mp
+
+
+# a pool of workers kept warm across mining calls: processes are started and import numpy
+# and pandas once, then every call only ships its tree (or eclat bitsets) through shared
+# memory, which workers map while they mine a batch. Use it in a with block or close it
+class Miner:
+    max_workers: int
+    executor: str
+    pool: Optional[concurrent.futures.Executor]
+
+    def __init__(self, max_workers = None, executor: Optional[str] = None):
+        max_workers = os.cpu_count() if max_workers is None else max_workers
+        executor = default_executor(max_workers) if executor is None else executor
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor must be one of {', '.join(EXECUTORS)}")
+        self.max_workers = max_workers if executor != 'serial' else 0
+        self.executor = executor if self.max_workers > 0 else 'serial'
+        if self.executor == 'thread':
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        elif self.executor == 'process':
+            # workers attaching to segments must share the tracker of this process, which
+            # forgets them once they are unlinked (see FlatFPTree.attach_segment)
+            if os.name == 'posix' and sys.version_info < (3, 13):
+                multiprocessing.resource_tracker.ensure_running()
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.pool = None
+
+    def __enter__(self) -> 'Miner':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    # see fpgrowth.fpgrowth_mp
+    def fpgrowth_mp(self, min_support: float, dataset: list[Transaction], cache: Optional[TreeCache] = None, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, include_items: Iterable[Hashable] = (), exclude_items: Iterable[Hashable] = (), algorithm: str = 'fpgrowth') -> pd.DataFrame:
+        return fpgrowth_mp(min_support, dataset, self.max_workers, cache, mode, min_len, max_len, include_items, exclude_items, algorithm, self.executor, self.__pool())
+
+    # see fpgrowth.fpgrowth_csr
+    def fpgrowth_csr(self, min_support: float, indptr: np.ndarray, items: np.ndarray, dictionary: Optional[list] = None, cache: Optional[TreeCache] = None, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, include_items: Iterable[Hashable] = (), exclude_items: Iterable[Hashable] = (), algorithm: str = 'fpgrowth') -> Iterator[tuple[float, frozenset]]:
+        return fpgrowth_csr(min_support, indptr, items, dictionary, self.max_workers, cache, mode, min_len, max_len, include_items, exclude_items, algorithm, self.executor, self.__pool())
+
+    def __pool(self) -> Optional[concurrent.futures.Executor]:
+        if self.pool is None and self.executor != 'serial':
+            raise ValueError("the miner is closed")
+        return self.pool
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import pickle
+from typing import Hashable, Iterable, Optional
+
+import numpy as np
+
+from .FlatFPTree import FlatFPTree
+
+
+# directory of saved trees, keyed by the content of the dataset and the integer min_support
+# they were built with. A tree built at a lower threshold covers every higher one
+class TreeCache:
+    directory: str
+    max_bytes: int
+
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 1 << 30):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    # trees built without some items are kept apart from those built with every item
+    @staticmethod
+    def dataset_key(indptr: np.ndarray, items: np.ndarray, excluded_items: Iterable[Hashable] = ()) -> str:
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(indptr, dtype=np.int64).tobytes())
+        items = np.asarray(items)
+        if items.dtype.kind == 'O':
+            digest.update(pickle.dumps(items.tolist()))
+        else:
+            digest.update(items.dtype.str.encode())
+            digest.update(np.ascontiguousarray(items).tobytes())
+        excluded_items = sorted(excluded_items, key=repr)
+        if len(excluded_items) > 0:
+            digest.update(pickle.dumps(excluded_items))
+        return digest.hexdigest()
+
+    # the cached tree with the highest threshold not above min_support, if any
+    def get(self, key: str, min_support: int) -> Optional[FlatFPTree]:
+        covering = [
+            (support, file) for support, file in self.__entries(key) if support <= min_support
+        ]
+        if len(covering) == 0:
+            return None
+        _, file = max(covering)
+        # entries are evicted least recently used first
+        os.utime(file)
+        return FlatFPTree.load(file)
+
+    # trees whose items cannot be saved (see FlatFPTree.can_save) are not cached
+    def put(self, key: str, tree: FlatFPTree) -> None:
+        if not tree.can_save():
+            return
+        file = self.__file(key, tree.fip.min_support)
+        # write then rename, concurrent readers never see a partial file
+        partial = file + '.partial.npz'
+        tree.save(partial)
+        os.replace(partial, file)
+        self.evict(keep=file)
+
+    # removes least recently used entries until the cache fits in max_bytes
+    def evict(self, keep: Optional[str] = None) -> None:
+        entries = [
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith('.npz') and not name.endswith('.partial.npz')
+        ]
+        entries.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(file) for file in entries)
+        for file in entries:
+            if total <= self.max_bytes:
+                break
+            if file == keep:
+                continue
+            total -= os.path.getsize(file)
+            os.remove(file)
+
+    def __file(self, key: str, min_support: int) -> str:
+        return os.path.join(self.directory, f"{key}-{min_support}.npz")
+
+    def __entries(self, key: str) -> list[tuple[int, str]]:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith(key + '-') and name.endswith('.npz') and not name.endswith('.partial.npz'):
+                entries.append((int(name[len(key) + 1:-len('.npz')]), os.path.join(self.directory, name)))
+        return entries
@@ -0,0 +1,138 @@
+import concurrent.futures
+import contextlib
+import functools
+import multiprocessing.shared_memory
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from .FlatFPTree import EXECUTORS, attach_segment, default_executor, schedule_labels
+from .FrequentItemPreprocessor import FrequentItemPreprocessor
+
+
+# mean number of frequent items per transaction over the number of frequent items,
+# above it the FP-tree hardly compresses the transactions and eclat is preferred
+ECLAT_DENSITY = 0.1
+
+def density(fip: FrequentItemPreprocessor, fitted: tuple[np.ndarray, np.ndarray]) -> float:
+    indptr, _ = fitted
+    if len(indptr) < 2 or fip.number_of_frequent_one_items == 0:
+        return 0.0
+    return (indptr[-1] - indptr[0]) / (len(indptr) - 1) / fip.number_of_frequent_one_items
+
+# transactions of every label as a bitset: bit t of row l is set when transaction t holds label l
+def tid_bitsets(fip: FrequentItemPreprocessor, fitted: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    indptr, labels = np.asarray(fitted[0]), np.asarray(fitted[1])
+    transactions_count = len(indptr) - 1
+    rows = np.repeat(np.arange(transactions_count, dtype=np.uint64), np.diff(indptr))
+    bits = np.zeros((fip.number_of_frequent_one_items, (transactions_count + 63) // 64), dtype=np.uint64)
+    np.bitwise_or.at(bits, (labels, (rows >> np.uint64(6)).astype(np.int64)), np.uint64(1) << (rows & np.uint64(63)))
+    return bits
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(bits: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+else:
+    POPCOUNT_TABLE = np.array([ bin(byte).count('1') for byte in range(256) ], dtype=np.int64)
+    def popcount(bits: np.ndarray) -> np.ndarray:
+        return POPCOUNT_TABLE[bits.view(np.uint8)].sum(axis=-1)
+
+# frequent itemsets of transactions fitted by fip (see FrequentItemPreprocessor.transform_batch),
+# as (support, labels) pairs like FlatFPTree.iter_itemsets. Itemsets sharing a prefix form a
+# class, the tidsets of a class are intersected with the tidset of each member all at once.
+# with workers each label's class is mined by a worker, executor and pool as in FlatFPTree.iter_itemsets
+def eclat_itemsets(fip: FrequentItemPreprocessor, fitted: tuple[np.ndarray, np.ndarray], max_workers: int = 0, min_len: int = 1, max_len: Optional[int] = None, required: Iterable[int] = (), executor: Optional[str] = None, pool: Optional[concurrent.futures.Executor] = None) -> Iterator[tuple[int, list[int]]]:
+    executor = default_executor(max_workers) if executor is None else executor
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {', '.join(EXECUTORS)}")
+    bits = tid_bitsets(fip, fitted)
+    # least frequent labels first, their classes are the smallest
+    members = np.arange(fip.number_of_frequent_one_items)[::-1]
+    supports = np.array([ fip.frequent_one_items[label].support for label in members.tolist() ], dtype=np.int64)
+    state = EclatState(fip.min_support, min_len, max_len, frozenset(required))
+
+    if max_workers > 0 and executor != 'serial' and len(members) > 0:
+        member_bits = bits[members]
+        if executor == 'thread':
+            labels = members.tolist()
+            def run(positions: list[int]):
+                return list(state.mine_class([], labels, member_bits, supports, positions))
+            shm, owned = None, concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) if pool is None else None
+        else:
+            # bitsets and supports go through shared memory, only its name goes with every class
+            shm = multiprocessing.shared_memory.SharedMemory(create=True, size=max(member_bits.nbytes + supports.nbytes, 1))
+            shared_bits, shared_supports = eclat_arrays(shm, member_bits.shape)
+            shared_bits[:] = member_bits
+            shared_supports[:] = supports
+            del shared_bits, shared_supports
+            run = functools.partial(mp_eclat, shm.name, member_bits.shape, state)
+            owned = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) if pool is None else None
+        futures = []
+        try:
+            with owned if owned is not None else contextlib.nullcontext(pool) as executor:
+                costs = supports * np.arange(len(members))[::-1]
+                futures = [
+                    executor.submit(run, positions)
+                    for positions in schedule_labels(costs.astype(np.float64), max_workers)
+                ]
+                for fut in concurrent.futures.as_completed(futures):
+                    yield from fut.result()
+        finally:
+            for fut in futures:
+                fut.cancel()
+            if shm is not None:
+                # running classes may still attach to it
+                concurrent.futures.wait(futures)
+                shm.close()
+                shm.unlink()
+    else:
+        yield from state.mine_class([], members.tolist(), bits[members], supports)
+
+class EclatState:
+    min_support: int
+    min_len: int
+    max_len: Optional[int]
+    required: frozenset[int]
+
+    def __init__(self, min_support: int, min_len: int, max_len: Optional[int], required: frozenset[int]):
+        self.min_support = min_support
+        self.min_len = min_len
+        self.max_len = max_len
+        self.required = required
+
+    # itemsets of the class of prefix, starting from the members at the given positions
+    def mine_class(self, prefix: list[int], labels: list[int], bits: np.ndarray, supports: np.ndarray, positions: Optional[Iterable[int]] = None) -> Iterator[tuple[int, list[int]]]:
+        for i in (range(len(labels)) if positions is None else positions):
+            itemset = prefix + [labels[i]]
+            # no itemset of this branch can hold the required labels
+            if not self.required.issubset(itemset + labels[i + 1:]):
+                continue
+            if len(itemset) >= self.min_len and self.required.issubset(itemset):
+                yield (int(supports[i]), itemset)
+            if self.max_len is not None and len(itemset) >= self.max_len:
+                continue
+
+            joined = bits[i + 1:] & bits[i]
+            joined_supports = popcount(joined)
+            frequent = np.flatnonzero(joined_supports >= self.min_support)
+            if len(frequent) > 0:
+                yield from self.mine_class(
+                    itemset, [ labels[i + 1 + j] for j in frequent.tolist() ], joined[frequent], joined_supports[frequent]
+                )
+
+# bitsets of the members of the first class, then their supports
+def eclat_arrays(shm: multiprocessing.shared_memory.SharedMemory, shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    bits = np.ndarray(shape, dtype=np.uint64, buffer=shm.buf)
+    supports = np.ndarray(shape[0], dtype=np.int64, buffer=shm.buf, offset=bits.nbytes)
+    return bits, supports
+
+# the segment is only mapped while a class is mined, as for trees (see FlatFPTree.mp_run)
+def mp_eclat(name: str, shape: tuple[int, int], state: EclatState, positions: list[int]):
+    shm = attach_segment(name)
+    bits, supports = eclat_arrays(shm, shape)
+    try:
+        labels = list(range(len(supports)))[::-1]
+        return list(state.mine_class([], labels, bits, supports, positions))
+    finally:
+        del bits, supports
+        shm.close()
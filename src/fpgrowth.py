@@ -1,41 +1,189 @@
-from src.FlatFPTree import FlatFPTree
-from src.FrequentItemPreprocessor import FrequentItemPreprocessor, Transaction, FittedTransaction
+from src.FlatFPTree import EXECUTORS, FlatFPTree, default_executor
+from src.FrequentItemPreprocessor import FrequentItemPreprocessor, Transaction, FittedTransaction, to_csr
+from src.transactions import TransactionSource, iter_csr_chunks
+from src.TreeCache import TreeCache
+from src.eclat import ECLAT_DENSITY, density, eclat_itemsets
 
 
+import numpy as np
 import pandas as pd
 
 
+import concurrent.futures
+import math
 import os
+from typing import Hashable, Iterable, Iterator, Optional, Sequence
 
 
-def fpgrowth_mp(min_support: float, dataset: list[Transaction], max_workers = None) -> pd.DataFrame:
+ALGORITHMS = ('fpgrowth', 'eclat', 'auto')
+
+# fewest transactions an itemset must be in to reach min_support, itemsets are mined and
+# filtered at this same count: a floor would mine itemsets below min_support, and closed or
+# maximal itemsets would be condensed against supersets that are dropped afterwards
+def support_count(transactions_count: int, min_support: float) -> int:
+    return max(0, math.ceil(transactions_count * min_support - 1e-9))
+
+def fpgrowth_iter(min_support: float, dataset: list[Transaction], max_workers = None, cache: Optional[TreeCache] = None, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, include_items: Iterable[Hashable] = (), exclude_items: Iterable[Hashable] = (), algorithm: str = 'fpgrowth', executor: Optional[str] = None, pool: Optional[concurrent.futures.Executor] = None) -> Iterator[tuple[float, frozenset]]:
+    yield from fpgrowth_csr(min_support, *to_csr(dataset), max_workers=max_workers, cache=cache, mode=mode, min_len=min_len, max_len=max_len, include_items=include_items, exclude_items=exclude_items, algorithm=algorithm, executor=executor, pool=pool)
+
+# same as fpgrowth_iter, over transactions stored as CSR arrays (see to_csr and load_binary).
+# when items are codes, dictionary maps them back to the original items.
+# mode picks all, closed or maximal itemsets and min_len, max_len bound their number of items,
+# see FlatFPTree.iter_itemsets. Itemsets hold every item of include_items and none of exclude_items.
+# algorithm 'eclat' mines vertical tidsets instead of a tree (see eclat_itemsets), for all
+# itemsets only; 'auto' picks it when the fitted transactions are dense and no tree is cached.
+# executor picks threads, processes or no workers at all (see FlatFPTree.iter_itemsets),
+# the tree is only built by processes with the 'process' executor. pool is an executor of
+# that kind kept across calls (see Miner), the workers are started for this call otherwise
+def fpgrowth_csr(min_support: float, indptr: np.ndarray, items: np.ndarray, dictionary: Optional[list] = None, max_workers = None, cache: Optional[TreeCache] = None, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, include_items: Iterable[Hashable] = (), exclude_items: Iterable[Hashable] = (), algorithm: str = 'fpgrowth', executor: Optional[str] = None, pool: Optional[concurrent.futures.Executor] = None) -> Iterator[tuple[float, frozenset]]:
     max_workers = os.cpu_count() if max_workers is None else max_workers
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"algorithm must be one of {', '.join(ALGORITHMS)}")
+    if algorithm == 'eclat' and mode != 'all':
+        raise ValueError("eclat only mines mode 'all'")
+    executor = default_executor(max_workers) if executor is None else executor
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {', '.join(EXECUTORS)}")
+    if executor == 'serial':
+        max_workers = 0
+
+    # constraints are given on the original items
+    if dictionary is not None:
+        codes = { item: code for code, item in enumerate(dictionary) }
+        # an item missing from the dictionary is in no transaction, nor in any itemset
+        if any(item not in codes for item in include_items):
+            return
+        include_items = [ codes[item] for item in include_items ]
+        exclude_items = [ codes[item] for item in exclude_items if item in codes ]
+    include_items = frozenset(include_items)
+    exclude_items = frozenset(exclude_items)
 
-    dataset_len = len(dataset)
+    dataset_len = len(indptr) - 1
     
     # convert min_support to integer
-    integer_min_support = int(dataset_len * min_support)
-    
-    # preprocess the data
-    fip = FrequentItemPreprocessor(integer_min_support)
-    fip.fit(dataset)
-    
-    # create the tree object
+    integer_min_support = support_count(dataset_len, min_support)
+
+    # a cached tree of the same dataset, built at the same or a lower threshold, skips fit and build
+    key = TreeCache.dataset_key(indptr, items, exclude_items) if cache is not None else None
+    tree = cache.get(key, integer_min_support) if cache is not None and algorithm != 'eclat' else None
+
+    if tree is None:
+        # preprocess the data
+        fip = FrequentItemPreprocessor(integer_min_support, exclude_items)
+        fip.fit_csr(indptr, items)
+        # transactions mapped to sorted labels in a single pass
+        fitted = fip.transform_batch(indptr, items)
+
+        if algorithm == 'eclat' or (algorithm == 'auto' and mode == 'all' and density(fip, fitted) >= ECLAT_DENSITY):
+            if not include_items.issubset(fip.frequent_one_items_map):
+                return
+            required = [ fip.frequent_one_items_map[item] for item in include_items ]
+            yield from __to_items(fip, eclat_itemsets(fip, fitted, max_workers, min_len, max_len, required, executor, pool), dictionary)
+            return
+
+        # create the tree from the transactions
+        tree = FlatFPTree.from_fitted(fip, fitted, max_workers=max_workers if executor == 'process' else 0, pool=pool)
+        if cache is not None:
+            cache.put(key, tree)
+    elif tree.fip.min_support < integer_min_support:
+        tree = tree.with_min_support(integer_min_support)
+
+    # an item that is not frequent is in no frequent itemset
+    if not include_items.issubset(tree.fip.frequent_one_items_map):
+        return
+    required = [ tree.fip.frequent_one_items_map[item] for item in include_items ]
+    yield from __iter_frequent_itemsets(tree, max_workers, dictionary, mode, min_len, max_len, required, executor, pool)
+
+# a tree that takes new transactions as they arrive (see FlatFPTree.append_transactions).
+# items are labelled from buffer_support on, so that the tree can still be mined at
+# min_support once the supports of some of them have grown past it
+def build_incremental(buffer_support: float, dataset: list[Transaction], max_workers = None) -> FlatFPTree:
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    indptr, items = to_csr(dataset)
+    fip = FrequentItemPreprocessor(int((len(indptr) - 1) * buffer_support))
+    fip.fit_csr(indptr, items)
+    return FlatFPTree.from_fitted(fip, fip.transform_batch(indptr, items), max_workers=max_workers)
+
+# mines a tree from build_incremental over all the transactions it has seen so far
+def fpgrowth_tree(min_support: float, tree: FlatFPTree, max_workers = None) -> Iterator[tuple[float, frozenset]]:
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    integer_min_support = support_count(tree.fip.transactions_count, min_support)
+    if not tree.fip.covers(integer_min_support):
+        raise ValueError("items that were left out of the tree may reach min_support, the tree must be built again")
+    if not tree.fip.is_ordered(integer_min_support):
+        tree.reorder()
+    yield from __iter_frequent_itemsets(tree.with_min_support(integer_min_support), max_workers)
+
+# two passes over a file or a re-iterable collection, read in chunks: the first one fits
+# the preprocessor, the second one builds the tree. The raw transactions are never held
+# in memory as a whole, only the tree is
+def fpgrowth_stream(min_support: float, source: TransactionSource, max_workers = None, chunk_size: int = 100_000, split_by: Optional[str] = None) -> Iterator[tuple[float, frozenset]]:
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+
+    # count every item first, the threshold depends on the number of transactions
+    fip = FrequentItemPreprocessor(0)
+    fip.fit_csr_chunks(iter_csr_chunks(source, chunk_size, split_by))
+    fip = fip.with_min_support(support_count(fip.transactions_count, min_support))
+
     tree = FlatFPTree(fip)
+    for indptr, items in iter_csr_chunks(source, chunk_size, split_by):
+        tree.add_fitted_transactions(*fip.transform_batch(indptr, items))
 
-    # add transactions
-    for trx in dataset:
-        tree.add_transaction(trx)
+    yield from __iter_frequent_itemsets(tree, max_workers)
 
-    # add itemsets
-    frequent_itemsets = tree.extract_itemsets(max_workers)
+# stream itemsets back in the items' space, as they are mined
+def __iter_frequent_itemsets(tree: FlatFPTree, max_workers: int, dictionary: Optional[list] = None, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, required: Sequence[int] = (), executor: Optional[str] = None, pool: Optional[concurrent.futures.Executor] = None) -> Iterator[tuple[float, frozenset]]:
+    yield from __to_items(tree.fip, tree.iter_itemsets(max_workers, mode, min_len, max_len, required, executor, pool), dictionary)
 
+# only itemsets reaching the preprocessor's support count, see support_count
+def __to_items(fip: FrequentItemPreprocessor, itemsets: Iterator[tuple[int, list[int]]], dictionary: Optional[list] = None) -> Iterator[tuple[float, frozenset]]:
+    for support, labels in itemsets:
+        if support >= fip.min_support:
+            items = fip.to_items(labels)
+            yield (support / fip.transactions_count, frozenset(items if dictionary is None else [ dictionary[item] for item in items ]))
+
+def fpgrowth_mp(min_support: float, dataset: list[Transaction], max_workers = None, cache: Optional[TreeCache] = None, mode: str = 'all', min_len: int = 1, max_len: Optional[int] = None, include_items: Iterable[Hashable] = (), exclude_items: Iterable[Hashable] = (), algorithm: str = 'fpgrowth', executor: Optional[str] = None, pool: Optional[concurrent.futures.Executor] = None) -> pd.DataFrame:
     # fit collected itemsets into a pandas' DataFrame
-    df = pd.DataFrame(data=frequent_itemsets, columns=('support', 'itemsets'))
-    df['itemsets'] = df['itemsets'].apply(lambda trx: frozenset(fip.to_items(trx)))
-    df['support'] = df['support'].apply(lambda x: x / dataset_len)
-    df = df[df['support'] >= min_support]
-    return df
+    return pd.DataFrame(
+        data=list(fpgrowth_iter(min_support, dataset, max_workers, cache, mode, min_len, max_len, include_items, exclude_items, algorithm, executor, pool)),
+        columns=('support', 'itemsets')
+    )
+
+# the k most frequent itemsets with at least min_len items, without a min_support:
+# the threshold is raised while mining, as better itemsets are found
+def fpgrowth_topk(dataset: list[Transaction], k: int, min_len: int = 1, max_workers = None) -> pd.DataFrame:
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    indptr, items = to_csr(dataset)
+
+    fip = FrequentItemPreprocessor(1)
+    fip.fit_csr(indptr, items)
+    # the k most frequent items are k itemsets already, no other item can be in a better one
+    if min_len <= 1 and k > 0 and fip.number_of_frequent_one_items >= k:
+        fip = fip.with_min_support(fip.frequent_one_items[k - 1].support)
+
+    tree = FlatFPTree.from_fitted(fip, fip.transform_batch(indptr, items), max_workers=max_workers)
+    return pd.DataFrame(
+        data=[
+            (support / fip.transactions_count, frozenset(fip.to_items(labels)))
+            for support, labels in tree.topk_itemsets(k, min_len)
+        ],
+        columns=('support', 'itemsets')
+    )
+
+# mines once at the lowest threshold, every higher threshold is answered by
+# filtering those results: frequent itemsets at a higher support are a subset
+def fpgrowth_sweep(dataset: list[Transaction], supports: Sequence[float], max_workers = None) -> dict[float, pd.DataFrame]:
+    if len(supports) == 0:
+        return dict()
+    df = fpgrowth_mp(min(supports), dataset, max_workers)
+    # thresholds are compared as support counts, as fpgrowth_mp does: a float threshold
+    # such as 0.1 * 3 must keep the itemsets it keeps when mined on its own
+    transactions_count = len(dataset)
+    counts = np.rint(df['support'].to_numpy() * transactions_count)
+    return {
+        min_support: df[counts >= support_count(transactions_count, min_support)].reset_index(drop=True)
+        for min_support in supports
+    }
 
 def fpgrowth(min_support: float, dataset: list[Transaction]) -> pd.DataFrame:
     return fpgrowth_mp(min_support, dataset, max_workers=0)
@@ -0,0 +1,112 @@
+import concurrent.futures
+import itertools
+import os
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+
+type Itemset = tuple[int, ...]
+
+# metrics of a rule from its support, confidence and the support of its consequent
+RULE_METRICS = {
+    'lift': lambda support, antecedent_support, consequent_support, confidence: confidence / consequent_support,
+    'leverage': lambda support, antecedent_support, consequent_support, confidence: support - antecedent_support * consequent_support,
+    'conviction': lambda support, antecedent_support, consequent_support, confidence: np.divide(
+        1 - consequent_support, 1 - confidence,
+        out=np.full(len(confidence), np.inf), where=confidence < 1
+    ),
+}
+
+# association rules from a ('support', 'itemsets') DataFrame as returned by fpgrowth_mp, which
+# must hold every subset of its itemsets. Items are coded into integers and itemsets into
+# sorted tuples of codes, which are hashed much faster than frozensets of the original items.
+# itemsets are split in groups, the rules of each group are generated by a worker
+def generate_rules(itemsets: pd.DataFrame, min_confidence: float, metrics: Sequence[str] = ('lift', 'leverage', 'conviction'), max_workers = None) -> pd.DataFrame:
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    for metric in metrics:
+        if metric not in RULE_METRICS:
+            raise ValueError(f"unknown metric {metric}, metrics are {', '.join(RULE_METRICS)}")
+
+    codes: dict = dict()
+    keys = [
+        tuple(sorted(codes.setdefault(item, len(codes)) for item in itemset))
+        for itemset in itemsets['itemsets']
+    ]
+    items = list(codes)
+    supports: dict[Itemset, float] = dict(zip(keys, itemsets['support'].tolist()))
+    candidates = [ key for key in keys if len(key) > 1 ]
+
+    if max_workers > 0 and len(candidates) > 0:
+        groups = [ list(group) for group in itertools.batched(candidates, -(-len(candidates) // (4 * max_workers))) ]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=mp_init_rules, initargs=tuple([supports])) as executor:
+            rules = list(itertools.chain.from_iterable(executor.map(mp_rules, groups, itertools.repeat(min_confidence))))
+    else:
+        rules = list(itertools.chain.from_iterable(
+            itemset_rules(supports, itemset, min_confidence) for itemset in candidates
+        ))
+
+    support = np.array([ support for _, _, support in rules ], dtype=np.float64)
+    antecedent_support = np.array([ __support(supports, antecedent) for antecedent, _, _ in rules ], dtype=np.float64)
+    consequent_support = np.array([ __support(supports, consequent) for _, consequent, _ in rules ], dtype=np.float64)
+    confidence = support / antecedent_support if len(rules) > 0 else support
+
+    columns = {
+        'antecedents': [ frozenset(items[code] for code in antecedent) for antecedent, _, _ in rules ],
+        'consequents': [ frozenset(items[code] for code in consequent) for _, consequent, _ in rules ],
+        'antecedent support': antecedent_support,
+        'consequent support': consequent_support,
+        'support': support,
+        'confidence': confidence,
+    }
+    for metric in metrics:
+        columns[metric] = RULE_METRICS[metric](support, antecedent_support, consequent_support, confidence)
+    return pd.DataFrame(columns)
+
+# rules (antecedent, consequent, support) splitting itemset. Consequents grow one item per
+# level and are only built from consequents that passed: moving items from the antecedent
+# to the consequent can only lower the confidence
+def itemset_rules(supports: dict[Itemset, float], itemset: Itemset, min_confidence: float) -> list[tuple[Itemset, Itemset, float]]:
+    support = supports[itemset]
+    rules = []
+    consequents = [ (item,) for item in itemset ]
+    while len(consequents) > 0 and len(consequents[0]) < len(itemset):
+        passed = []
+        for consequent in consequents:
+            antecedent = tuple(item for item in itemset if item not in consequent)
+            if support / __support(supports, antecedent) >= min_confidence:
+                passed.append(consequent)
+                rules.append((antecedent, consequent, support))
+        consequents = __join_consequents(passed)
+    return rules
+
+# consequents one item longer, as in apriori-gen: two sorted consequents sharing all
+# but their last item are joined, and kept only if every other subset passed as well
+def __join_consequents(consequents: list[Itemset]) -> list[Itemset]:
+    passed = set(consequents)
+    joined = []
+    for i, first in enumerate(consequents):
+        for second in consequents[i + 1:]:
+            if first[:-1] != second[:-1]:
+                break
+            consequent = first + second[-1:]
+            if all(consequent[:j] + consequent[j + 1:] in passed for j in range(len(consequent) - 2)):
+                joined.append(consequent)
+    return joined
+
+def __support(supports: dict[Itemset, float], itemset: Itemset) -> float:
+    support = supports.get(itemset)
+    if support is None:
+        raise ValueError("itemsets must hold every subset of each itemset, mine them with mode 'all' and no length limits")
+    return support
+
+def mp_init_rules(supports: dict[Itemset, float]):
+    global rule_supports
+    rule_supports = supports
+def mp_rules(itemsets: list[Itemset], min_confidence: float):
+    global rule_supports
+    result = []
+    for itemset in itemsets:
+        result += itemset_rules(rule_supports, itemset, min_confidence)
+    return result
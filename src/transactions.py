@@ -0,0 +1,94 @@
+import itertools
+import json
+import os
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from .FrequentItemPreprocessor import Transaction, to_csr, unique_codes
+
+
+type TransactionSource = str | os.PathLike | Iterable[Transaction]
+
+# reads one transaction of integer items per line, lines that do not parse are skipped.
+# items are separated by commas in .csv files and by whitespace otherwise
+def read_transactions(path: str | os.PathLike, split_by: Optional[str] = None) -> Iterator[Transaction]:
+    if split_by is None and os.fspath(path).endswith('.csv'):
+        split_by = ','
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                trx = [ int(x) for x in line.strip().split(split_by) ]
+                if len(trx) > 0:
+                    yield trx
+            except ValueError:
+                pass
+
+# CSR chunks of at most chunk_size transactions, a new pass over the source on every call.
+# one-shot iterators are rejected since they cannot be read more than once
+def iter_csr_chunks(source: TransactionSource, chunk_size: int = 100_000, split_by: Optional[str] = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    if isinstance(source, (str, os.PathLike)):
+        transactions = read_transactions(source, split_by)
+    elif iter(source) is source:
+        raise TypeError("transactions must be a path or a collection that can be iterated more than once")
+    else:
+        transactions = source
+    for chunk in itertools.batched(transactions, chunk_size):
+        yield to_csr(chunk)
+
+# binary format: a fixed header, the item dictionary as JSON, then the CSR arrays
+#   magic (8 bytes) | rows: uint64 | items: uint64 | dictionary bytes: uint64
+#   dictionary, padded to 8 bytes | indptr: int64[rows + 1] | items: int32[items]
+# items are stored as codes, the dictionary maps codes back to the original items
+BINARY_MAGIC = b'FPTRX\x00\x00\x01'
+BINARY_HEADER = np.dtype([('magic', 'S8'), ('rows', '<u8'), ('items', '<u8'), ('dictionary', '<u8')])
+
+def write_binary(path: str | os.PathLike, indptr: np.ndarray, items: np.ndarray, dictionary: list):
+    encoded = json.dumps(dictionary).encode()
+    encoded += b' ' * (-len(encoded) % 8)
+    header = np.array([(BINARY_MAGIC, len(indptr) - 1, len(items), len(encoded))], dtype=BINARY_HEADER)
+    with open(path, 'wb') as file:
+        file.write(header.tobytes())
+        file.write(encoded)
+        file.write(np.asarray(indptr, dtype='<i8').tobytes())
+        file.write(np.asarray(items, dtype='<i4').tobytes())
+
+# the CSR arrays are memory mapped read only, so loading costs no parsing and
+# processes reading the same file share its pages
+def load_binary(path: str | os.PathLike) -> tuple[np.ndarray, np.ndarray, list]:
+    header = np.fromfile(path, dtype=BINARY_HEADER, count=1)[0]
+    if header['magic'] != BINARY_MAGIC:
+        raise ValueError(f"{os.fspath(path)} is not a binary transactions file")
+    rows, items_count, dictionary_size = int(header['rows']), int(header['items']), int(header['dictionary'])
+    with open(path, 'rb') as file:
+        file.seek(BINARY_HEADER.itemsize)
+        dictionary = json.loads(file.read(dictionary_size))
+    offset = BINARY_HEADER.itemsize + dictionary_size
+    indptr = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(rows + 1,))
+    offset += 8 * (rows + 1)
+    items = np.memmap(path, dtype='<i4', mode='r', offset=offset, shape=(items_count,)) \
+        if items_count > 0 else np.zeros(0, dtype='<i4')
+    return indptr, items, dictionary
+
+# converts a text dataset (see read_transactions) to the binary format,
+# items get their codes chunk by chunk, as they are first seen
+def convert_to_binary(source: str | os.PathLike, destination: str | os.PathLike, split_by: Optional[str] = None, chunk_size: int = 100_000):
+    codes: dict = dict()
+    dictionary: list = []
+    lengths: list[np.ndarray] = []
+    coded: list[np.ndarray] = []
+    for indptr, items in iter_csr_chunks(source, chunk_size, split_by):
+        unique_items, inverse = unique_codes(items)
+        for item in unique_items.tolist():
+            if item not in codes:
+                codes[item] = len(dictionary)
+                dictionary.append(item)
+        chunk_codes = np.array([ codes[item] for item in unique_items.tolist() ], dtype=np.int32)
+        lengths.append(np.diff(indptr))
+        coded.append(chunk_codes[inverse] if len(chunk_codes) > 0 else np.zeros(0, dtype=np.int32))
+
+    indptr = np.zeros(sum(len(chunk) for chunk in lengths) + 1, dtype=np.int64)
+    if len(lengths) > 0:
+        np.cumsum(np.concatenate(lengths), out=indptr[1:])
+    items = np.concatenate(coded) if len(coded) > 0 else np.zeros(0, dtype=np.int32)
+    write_binary(destination, indptr, items, dictionary)